@@ -6,11 +6,25 @@ def plugin_is_focused() -> bool: ...
 class PPVar:
     def __init__(self, time_window: float = 0, tolerance: float = inf) -> None: ...
     def update(self, new_value: float | None) -> Any: ...
+class PPVarArray:
+    def __init__(self, size: int, time_window: float = 0, tolerance: float = inf) -> None: ...
+    def update(self, new_values) -> numpy.ndarray: ...
 def capture(regions: tuple[str] = (), file: str = None, debug=False) -> bool: ...
-def match_template(template: str, region: str, filter=None, div: tuple = (0, 1, 0, 1), debug: bool = False) -> dict: ...
+def get_capture_time() -> float: ...
+def match_template(template: str, region: str, filter=None, div: tuple = (0, 1, 0, 1), debug: bool = False, pyramid_levels: int = None, track: bool = False) -> dict: ...
+def match_templates(templates: tuple[str], region: str, filter=None, div: tuple = (0, 1, 0, 1), best_only: bool = False, debug: bool = False) -> list[dict] | dict: ...
 def get_region_fill_ratio(region: str, filter=None, div: tuple = (0, 1, 0, 1), debug: bool = False) -> float: ...
+def get_region_fill_ratios(region: str, filter=None, divs: tuple[tuple] = (), debug: bool = False) -> list[float]: ...
+def get_region_fill_boundary(region: str, filter=None, direction: str = 'left_to_right', debug: bool = False) -> float: ...
+def run_parallel(functions: list) -> list: ...
+def get_result_cache_stats() -> dict: ...
 def cv_in_range(img, lower: 'tuple', upper: 'tuple'): ...
 def cv_to_hsv(img): ...
 def cv_to_gray(img): ...
+class CVFilter:
+    def __init__(self, steps: 'tuple' = ()): ...
+    def in_range(self, lower: 'tuple', upper: 'tuple') -> 'CVFilter': ...
+    def to_gray(self) -> 'CVFilter': ...
+    def to_hsv(self) -> 'CVFilter': ...
 def read_pointer(pointer_name: str, debug=False): ...
 def http_get(url: str, timeout=0.1) -> dict: ...
@@ -0,0 +1,277 @@
+"""Benchmarks the CV, PPVar and script hot paths on synthetic workloads.
+
+Frames and templates are generated at each resolution and fed through the file
+capture route, so no screen or window is needed. Each operation reports its
+latency percentiles and the memory it allocates per call, and runs can be
+saved as baselines to compare later runs against.
+
+Usage: python -m pp_script.benchmark [--resolutions 1080p 4k] [--save FILE]
+    [--compare FILE]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import tracemalloc
+import cv2 as cv
+import numpy as np
+from itertools import cycle
+from time import perf_counter_ns
+
+from pp_script.core import PluginArchive, PPVar, Rect
+from pp_script.detection.computer_vision import ComputerVision, CVFilter
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+}
+TEMPLATES = 8
+TEMPLATE_SIZE = 32
+
+# Regions and template positions in the 1920x1080 reference resolution
+_REGIONS = {
+    "hud": {"rect": {"x": 100, "y": 80, "w": 300, "h": 200}},
+    "bar": {"rect": {"x": 1300, "y": 960, "w": 500, "h": 40}},
+    "big": {"rect": {"x": 700, "y": 350, "w": 400, "h": 300}},
+}
+_TEMPLATE_POSITIONS = [(180, 120), (900, 500)]
+_BAR_COLOR = (220, 30, 30)
+_BAR_FILTER = CVFilter().to_hsv().in_range((240, 100, 100), (10, 255, 255))
+
+_SCRIPT = """
+hp = PPVar(time_window=1)
+init({"events": {"hit": {}}, "cv": CV_VALUES})
+def update():
+    if capture(file="frame.png"):
+        hit = match_template("t0", "hud", filter=CVFilter().to_gray())
+        fill = get_region_fill_ratio("bar", filter=BAR_FILTER)
+        hp.update(fill)
+        if hit["success"]:
+            raise_event({"type": "hit", "amount": hit["confidence"], "hp": hp.value})
+"""
+
+
+def write_workload(folder: str, resolution: tuple[int, int], seed: int = 0):
+    """Writes a plugin with a synthetic frame at the resolution, the templates
+    and a script running the usual update of a plugin"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    frame = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    frame = cv.GaussianBlur(frame, (5, 5), 0)
+    templates = []
+    for i in range(TEMPLATES):
+        template = rng.integers(0, 256, (TEMPLATE_SIZE, TEMPLATE_SIZE, 3), np.uint8)
+        templates.append(template)
+        cv.imwrite(os.path.join(folder, f"t{i}.png"), template[:, :, ::-1])
+    for (x, y), template in zip(_TEMPLATE_POSITIONS, templates):
+        frame[y : y + TEMPLATE_SIZE, x : x + TEMPLATE_SIZE] = template
+    bar = _REGIONS["bar"]["rect"]
+    frame[bar["y"] : bar["y"] + bar["h"], bar["x"] : bar["x"] + bar["w"] * 2 // 3] = (
+        _BAR_COLOR
+    )
+    frame = cv.resize(frame, resolution, interpolation=cv.INTER_NEAREST)
+    cv.imwrite(os.path.join(folder, "frame.png"), frame[:, :, ::-1])
+
+    script = _SCRIPT.replace("CV_VALUES", repr(cv_values()))
+    script = script.replace("BAR_FILTER", _filter_source(_BAR_FILTER))
+    with open(os.path.join(folder, "script.py"), "w") as file:
+        file.write(script)
+    with open(os.path.join(folder, "metadata.yaml"), "w") as file:
+        file.write("name: Benchmark\nscript: script.py\nreq_lib_ver: 3\n")
+
+
+def cv_values(**options) -> dict:
+    templates = {
+        f"t{i}": {"file": f"t{i}.png", "threshold": 0.9} for i in range(TEMPLATES)
+    }
+    return {"regions": _REGIONS, "templates": templates} | options
+
+
+def _filter_source(filter: CVFilter) -> str:
+    source = "CVFilter()"
+    for name, *args in filter.steps:
+        source += f".{name}({', '.join(repr(arg) for arg in args)})"
+    return source
+
+
+def operations(folder: str, resolution: tuple[int, int]) -> dict:
+    """Operations by name as (setup, run) pairs, only run is measured"""
+    archive = PluginArchive(folder)
+    debug_folder = os.path.join(folder, "debug")
+    # Results are not reused, otherwise the same frame would only be measured
+    # once and then served from the cache
+    cv_obj = ComputerVision(cv_values(reuse_results=False), archive, debug_folder)
+    cv_obj.update(Rect((0, 0) + resolution), True)
+    cv_obj.capture(file="frame.png")
+    hud = cv_obj._regions["hud"]
+    template = cv_obj._templates["t0"]
+    template_names = tuple(f"t{i}" for i in range(TEMPLATES))
+    rect = Rect((0, 0) + resolution)
+    pp_var = PPVar(time_window=1)
+    values = cycle(np.random.default_rng(0).random(1000).tolist())
+
+    # Filtered crops are cached per capture, so filtering is only measured
+    # with the cache cleared. capture(file) replaces the capture, so the
+    # current one is cleared
+    def clear_crops():
+        cv_obj._capture._crops.clear()
+        cv_obj._capture._crops_bytes = 0
+
+    def clear_scales():
+        template._scales.clear()
+
+    plugin = _benchmark_plugin(folder, resolution)
+
+    return {
+        "capture(file)": (None, lambda: cv_obj.capture(file="frame.png")),
+        "get_region_crop": (clear_crops, lambda: cv_obj._capture.get_region_crop(hud)),
+        "get_region_crop(hsv)": (
+            clear_crops,
+            lambda: cv_obj._capture.get_region_crop(hud, CVFilter().to_hsv()),
+        ),
+        "match_template": (None, lambda: cv_obj.match_template("t0", "hud")),
+        "match_template(gray)": (
+            clear_crops,
+            lambda: cv_obj.match_template("t0", "hud", filter=CVFilter().to_gray()),
+        ),
+        "match_templates(big)": (
+            None,
+            lambda: cv_obj.match_templates(template_names, "big", best_only=True),
+        ),
+        "get_region_fill_ratio": (
+            clear_crops,
+            lambda: cv_obj.get_region_fill_ratio("bar", filter=_BAR_FILTER),
+        ),
+        "Template.scale": (clear_scales, lambda: template.scale(rect)),
+        "PPVar.update": (None, lambda: pp_var.update(next(values))),
+        "ImportedPlugin.update": (None, plugin.update),
+    }
+
+
+def _benchmark_plugin(folder: str, resolution: tuple[int, int]):
+    from pp_script.plugin_import import try_import_plugin_at_folder
+
+    plugin_class = try_import_plugin_at_folder(folder)
+
+    class BenchmarkPlugin(plugin_class):  # type: ignore
+        DEBUG_FOLDER = os.path.join(folder, "debug")
+
+        def _update_focus_and_rect(self):
+            return Rect((0, 0) + resolution), True, "Benchmark"
+
+        def update(self):
+            super().update()
+            self.post_update()
+
+    return BenchmarkPlugin()
+
+
+def measure(setup, run, iterations: int, warmup: int = 3) -> dict:
+    """Latency percentiles in microseconds and the peak memory allocated by one
+    call in KiB"""
+    for _ in range(warmup):
+        setup and setup()
+        run()
+
+    times = np.empty(iterations)
+    for i in range(iterations):
+        setup and setup()
+        start = perf_counter_ns()
+        run()
+        times[i] = perf_counter_ns() - start
+    times /= 1000
+
+    allocated = []
+    tracemalloc.start()
+    try:
+        for _ in range(min(iterations, 5)):
+            setup and setup()
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - current)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50": float(np.percentile(times, 50)),
+        "p90": float(np.percentile(times, 90)),
+        "p99": float(np.percentile(times, 99)),
+        "max": float(times.max()),
+        "alloc_kib": float(np.median(allocated)) / 1024,
+    }
+
+
+def run_benchmarks(resolutions: list[str], iterations: int) -> dict:
+    """Results by "operation@resolution" """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="pp_script_benchmark") as folder:
+        for name in resolutions:
+            resolution = RESOLUTIONS[name]
+            workload = os.path.join(folder, name)
+            write_workload(workload, resolution)
+            for operation, (setup, run) in operations(workload, resolution).items():
+                result = measure(setup, run, iterations)
+                results[f"{operation}@{name}"] = result
+                print(_format_result(f"{operation}@{name}", result), flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Names of the operations whose median latency grew by more than the
+    threshold ratio"""
+    regressions = []
+    print(f"\n{'operation':<34} {'baseline':>10} {'p50':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["p50"] / max(baseline[name]["p50"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(
+            f"{name:<34} {baseline[name]['p50']:>10.1f} {result['p50']:>10.1f}"
+            f" {ratio:>6.2f}x{flag}"
+        )
+    return regressions
+
+
+def _format_result(name: str, result: dict) -> str:
+    times = " ".join(f"{key}={result[key]:>9.1f}us" for key in ("p50", "p90", "p99"))
+    return f"{name:<34} {times} alloc={result['alloc_kib']:>8.1f}KiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks PP Script hot paths")
+    parser.add_argument(
+        "--resolutions", nargs="+", choices=RESOLUTIONS, default=list(RESOLUTIONS)
+    )
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--save", help="save the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="median latency ratio reported as a regression",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.resolutions, args.iterations)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
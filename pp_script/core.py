@@ -1,20 +1,39 @@
+import copy
 import logging
+import mmap
 import mss
+import numpy as np
 import os
+import re
+import struct
+import threading
 import zipfile
+from collections import deque
+from itertools import count
 from math import ceil
 from typing import Any
-from pywinctl import getWindowsWithTitle, Re
 from time import perf_counter
 
 _logger = logging.getLogger().getChild("pp_script")
 
 
+_clock = perf_counter
+
+
 def get_time() -> float:
-    return perf_counter()
+    return _clock()
+
+
+def set_clock(clock=None):
+    """Replaces the time source of get_time, for example with the virtual time
+    of a replayed session. None restores perf_counter"""
+    global _clock
+    _clock = perf_counter if clock is None else clock
 
 
 class EventType:
+    __slots__ = ("_name", "_description", "normalize")
+
     def __init__(self, values: dict):
         self._name = values["name"]
         self._description = values.get("description")
@@ -25,6 +44,8 @@ class EventType:
 
 
 class Event:
+    __slots__ = ("_type", "_raw_amount", "_scaled_amount", "other_data")
+
     def __init__(self, event_type: EventType | None, values: dict):
         self._type: EventType | None = event_type
         self._raw_amount = values.pop("amount", None)
@@ -60,12 +81,107 @@ class Event:
         return text
 
 
+class EventID:
+    """Unique ID for events raised without one, cheaper than a uuid4"""
+
+    __slots__ = ("_number",)
+    _counter = count()
+
+    def __init__(self):
+        self._number = next(EventID._counter)
+
+    def __repr__(self):
+        return f"EventID({self._number})"
+
+
+class EventBatch(dict):
+    """Events raised during one update, keyed by their ID"""
+
+    __slots__ = ()
+
+    def add(self, event: Event, event_id=None):
+        if event_id is None:
+            event_id = EventID()
+        self[event_id] = event
+        return event_id
+
+
+class _SampleBuffer:
+    """Time ordered (time, value) samples with amortized O(1) eviction and O(1)
+    min/max lookup through monotonic deques"""
+
+    def __init__(self):
+        self._samples: deque[tuple[int, float, float]] = deque()  # (index, time, value)
+        self._min: deque[tuple[int, float]] = deque()  # (index, value), increasing
+        self._max: deque[tuple[int, float]] = deque()  # (index, value), decreasing
+        self._next_index = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def oldest_time(self) -> float:
+        return self._samples[0][1]
+
+    @property
+    def min(self) -> float:
+        return self._min[0][1]
+
+    @property
+    def max(self) -> float:
+        return self._max[0][1]
+
+    def clear(self):
+        self._samples.clear()
+        self._min.clear()
+        self._max.clear()
+
+    def append(self, time: float, value: float):
+        if self._samples and self._samples[-1][1] == time:
+            # Same timestamp overwrites the previous sample, the monotonic
+            # deques might be missing values it dominated, so rebuild them
+            self._samples.pop()
+            self._samples.append((self._new_index(), time, value))
+            self._min.clear()
+            self._max.clear()
+            for index, _, v in self._samples:
+                self._push_min_max(index, v)
+            return
+
+        index = self._new_index()
+        self._samples.append((index, time, value))
+        self._push_min_max(index, value)
+
+    def drop_older_samples(self, time: float, time_window: float):
+        # Drop samples while the next one is also at least time_window old
+        samples = self._samples
+        while len(samples) > 1 and time - samples[1][1] >= time_window:
+            index = samples.popleft()[0]
+            if self._min[0][0] == index:
+                self._min.popleft()
+            if self._max[0][0] == index:
+                self._max.popleft()
+
+    def _new_index(self):
+        index = self._next_index
+        self._next_index += 1
+        return index
+
+    def _push_min_max(self, index: int, value: float):
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+
+
 class PPVar:
     def __init__(self, time_window: float = 0, tolerance: float = float("inf")) -> None:
         self._time_window = time_window
         self._tolerance = tolerance
         self._value = None
-        self._buffer = {}
+        self._buffer = _SampleBuffer()
 
     @property
     def value(self):
@@ -73,29 +189,25 @@ class PPVar:
 
     def update(self, new_value: float | None) -> Any:
         if new_value is None:
-            self._buffer = {}
+            self._buffer.clear()
             self._value = None
             return None
 
         time = get_time()
-        self._buffer[time] = new_value
-
-        # Leave the values inside the time window and the first one outside it, delete the rest
-        buffered_enough_values = False
-        for k in sorted(list(self._buffer), reverse=True):
-            if buffered_enough_values:
-                del self._buffer[k]
-                continue
-            time_delta = time - k
-            if self._time_window <= time_delta <= 2 * self._time_window:
-                buffered_enough_values = True
-
-        if not buffered_enough_values:
+        self._buffer.append(time, new_value)
+
+        # Leave the values inside the time window and the first one outside it,
+        # delete the rest. Samples older than twice the time window are kept
+        # until a newer one leaves the window, but the update fails meanwhile
+        self._buffer.drop_older_samples(time, self._time_window)
+        time_delta = time - self._buffer.oldest_time
+        if not self._time_window <= time_delta <= 2 * self._time_window:
             return None
 
-        for value in self._buffer.values():
-            if abs(new_value - value) > self._tolerance:
-                return None
+        if new_value - self._buffer.min > self._tolerance:
+            return None
+        if self._buffer.max - new_value > self._tolerance:
+            return None
 
         delta = None
         if self._value is not None:
@@ -105,20 +217,165 @@ class PPVar:
         return delta
 
 
-def read_file_at_folder_or_zip(folder_path: str, file_path: str) -> bytes:
-    if folder_path.endswith(".zip"):
-        with zipfile.ZipFile(folder_path) as zip:
+class PPVarArray:
+    """Same as PPVar but for many values updated at the same time, missing
+    values and failed updates are represented by NaN"""
+
+    def __init__(
+        self,
+        size: int,
+        time_window: float = 0,
+        tolerance: float = float("inf"),
+    ) -> None:
+        self._time_window = time_window
+        self._tolerance = tolerance
+        self._value = np.full(size, np.nan)
+        # Sample times are shared by all values, rows from _head to _tail are
+        # in use, values from before a reset are NaN
+        self._times = np.empty(16)
+        self._buffer = np.full((16, size), np.nan)
+        self._head = 0
+        self._tail = 0
+
+    @property
+    def value(self) -> np.ndarray:
+        value = self._value.view()
+        value.flags.writeable = False
+        return value
+
+    def update(self, new_values) -> np.ndarray:
+        size = self._value.shape[0]
+        if new_values is None:
+            new_values = np.full(size, np.nan)
+        new_values = np.asarray(new_values, dtype=np.float64)
+        if new_values.shape != (size,):
+            raise ValueError(f"Expected {size} values, got shape {new_values.shape}")
+
+        missing = np.isnan(new_values)
+        if missing.any():
+            self._buffer[self._head : self._tail, missing] = np.nan
+            self._value[missing] = np.nan
+
+        time = get_time()
+        self._append(time, new_values)
+
+        # Leave the values inside the time window and the first one outside it
+        times = self._times
+        while self._tail - self._head > 1:
+            if time - times[self._head + 1] < self._time_window:
+                break
+            self._head += 1
+
+        samples = self._buffer[self._head : self._tail]
+        valid = ~np.isnan(samples)
+        # The oldest sample of each value is the first non NaN one
+        oldest = times[self._head + np.argmax(valid, axis=0)]
+        time_delta = time - oldest
+        ok = ~missing
+        ok &= self._time_window <= time_delta
+        ok &= time_delta <= 2 * self._time_window
+
+        if self._tolerance != float("inf"):
+            with np.errstate(invalid="ignore"):
+                low = np.where(valid, samples, np.inf).min(axis=0)
+                high = np.where(valid, samples, -np.inf).max(axis=0)
+            ok &= new_values - low <= self._tolerance
+            ok &= high - new_values <= self._tolerance
+
+        delta = np.where(ok, new_values - self._value, np.nan)
+        self._value[ok] = new_values[ok]
+        return delta
+
+    def _append(self, time: float, new_values: np.ndarray):
+        if self._tail > self._head and self._times[self._tail - 1] == time:
+            # Same timestamp overwrites the previous sample
+            self._buffer[self._tail - 1] = new_values
+            return
+
+        if self._tail == self._times.shape[0]:
+            count = self._tail - self._head
+            capacity = self._times.shape[0]
+            if count * 2 > capacity:
+                capacity *= 2
+            times = np.empty(capacity)
+            buffer = np.full((capacity, self._buffer.shape[1]), np.nan)
+            times[:count] = self._times[self._head : self._tail]
+            buffer[:count] = self._buffer[self._head : self._tail]
+            self._times, self._buffer = times, buffer
+            self._head, self._tail = 0, count
+
+        self._times[self._tail] = time
+        self._buffer[self._tail] = new_values
+        self._tail += 1
+
+
+class PluginArchive:
+    """Files of a plugin folder or zip. A zip is opened and indexed once, and
+    its stored (uncompressed) members are served from a memory map"""
+
+    _LOCAL_HEADER_SIZE = 30
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._zip: zipfile.ZipFile = None  # type: ignore
+        self._mmap: mmap.mmap = None  # type: ignore
+        self._entries: dict[str, zipfile.ZipInfo] = {}
+        if path.endswith(".zip"):
+            self._file = open(path, "rb")
             try:
-                with zip.open(file_path) as file:
-                    return file.read()
-            except KeyError:
-                raise FileNotFoundError()
-    else:
-        with open(os.path.join(folder_path, file_path), "rb") as file:
-            return file.read()
+                self._zip = zipfile.ZipFile(self._file)
+                self._entries = {info.filename: info for info in self._zip.infolist()}
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except BaseException:
+                self._file.close()
+                raise
+
+    def read(self, file_path: str) -> bytes:
+        if self._zip is None:
+            with open(os.path.join(self.path, file_path), "rb") as file:
+                return file.read()
+        with self.view(file_path) as view:
+            return bytes(view)
+
+    def view(self, file_path: str) -> memoryview:
+        """Read only view of the file, without copying stored zip members"""
+        if self._zip is None:
+            return memoryview(self.read(file_path))
+
+        info = self._entries.get(file_path)
+        if info is None:
+            raise FileNotFoundError(f"{file_path} not found in {self.path}")
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return memoryview(self._zip.read(info))
+
+        # The local header has variable length name and extra fields
+        header = self._mmap[
+            info.header_offset : info.header_offset + self._LOCAL_HEADER_SIZE
+        ]
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = info.header_offset + self._LOCAL_HEADER_SIZE
+        start += name_length + extra_length
+        return memoryview(self._mmap)[start : start + info.file_size]
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._mmap.close()
+            self._file.close()  # type: ignore
+
+
+def read_file_at_folder_or_zip(folder_path: str, file_path: str) -> bytes:
+    archive = PluginArchive(folder_path)
+    try:
+        return archive.read(file_path)
+    finally:
+        archive.close()
 
 
 class Rect:
+    __slots__ = ("left", "top", "width", "height")
+
     def __init__(self, rect):
         if isinstance(rect, dict):
             left = next((rect[k] for k in ("x", "left") if k in rect))
@@ -181,39 +438,147 @@ class Rect:
         return f"{self.as_dict()}"
 
 
-def get_monitor_rect(monitor_number: int):
-    with mss.mss() as sct:
-        monitors = sct.monitors
-        if monitor_number >= len(monitors):
+class MonitorLayout:
+    """Monitor rects read through a long lived mss instance per thread, the
+    rects are only rebuilt when the monitor layout changes"""
+
+    def __init__(self, open_mss=None):
+        self._open_mss = open_mss or mss.mss
+        self._local = threading.local()
+        # The mss instances of every thread, so they can be closed together
+        self._instances: list = []
+        self._lock = threading.Lock()
+        self._layout: tuple[tuple[int, int, int, int], ...] = ()
+        self._rects: list[Rect] = []
+
+    def refresh(self) -> bool:
+        """Reads the monitor geometry again, returns whether it changed"""
+        with self._lock:
+            sct = self._instance()
+            # mss only enumerates the monitors once per instance, so its private
+            # cache is reset to the value it had before enumerating, which is []
+            # up to mss 10.0 and None in later versions
+            sct._monitors = copy.copy(self._local.unloaded_monitors)
+            monitors = sct.monitors
+            if not monitors:
+                # The reset didn't work with this mss version, a new instance
+                # enumerates the monitors
+                self._instances.remove(sct)
+                sct.close()
+                monitors = self._instance().monitors
+        layout = tuple((m["left"], m["top"], m["width"], m["height"]) for m in monitors)
+        if layout == self._layout:
+            return False
+        self._rects = [Rect(m) for m in layout]
+        self._layout = layout
+        return True
+
+    def _instance(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None or sct not in self._instances:
+            sct = self._local.sct = self._open_mss()
+            self._local.unloaded_monitors = copy.copy(getattr(sct, "_monitors", None))
+            self._instances.append(sct)
+        return sct
+
+    def close(self):
+        """Closes the mss instances of every thread, later refreshes open new
+        ones"""
+        with self._lock:
+            for sct in self._instances:
+                sct.close()
+            self._instances.clear()
+
+    def get_rect(self, monitor_number: int) -> Rect:
+        rects = self._rects
+        if monitor_number >= len(rects):
             _logger.warning(
                 f"Failed to get monitor {monitor_number}, returning monitor 1 instead"
             )
             monitor_number = 1
-        return Rect(monitors[monitor_number])
+        return rects[monitor_number]
 
 
-def get_window_info(regex: str):
-    rect = None
-    focused = False
-    title = None
-
-    window = None  # Maybe cache the windows
-    if not window:
-        results = getWindowsWithTitle(regex, condition=Re.MATCH)
-        if results:
-            window = results[0]
-
-    if window:
-        rect = window.getClientFrame()
-        rect = Rect(
-            (
-                rect.left,
-                rect.top,
-                rect.right - rect.left,
-                rect.bottom - rect.top,
+_monitor_layout = MonitorLayout()
+
+
+def get_monitor_rect(monitor_number: int):
+    _monitor_layout.refresh()
+    return _monitor_layout.get_rect(monitor_number)
+
+
+def close_monitor_layout():
+    """Releases the mss instances used to read the monitor geometry"""
+    _monitor_layout.close()
+
+
+class WindowTracker:
+    """Keeps the first window whose title matches the regex, windows are only
+    searched again when the tracked one closes or its title stops matching"""
+
+    def __init__(self, regex: str, find_windows=None):
+        self._regex = regex
+        self._pattern = re.compile(regex)
+        self._find_windows = find_windows
+        self._window = None
+
+    def get_info(self):
+        rect = None
+        focused = False
+        title = None
+
+        if self._window is not None:
+            title = self._tracked_window_title()
+            if title is None:
+                self._window = None
+
+        if self._window is None:
+            results = self._search_windows()
+            if results:
+                self._window = results[0]
+                title = self._window.title
+
+        if self._window:
+            rect = self._window.getClientFrame()
+            rect = Rect(
+                (
+                    rect.left,
+                    rect.top,
+                    rect.right - rect.left,
+                    rect.bottom - rect.top,
+                )
             )
-        )
-        focused = window.isActive
-        title = window.title
+            focused = self._window.isActive
+
+        return rect, focused, title
+
+    def _search_windows(self) -> list:
+        """Windows whose title matches the regex, find_windows is called with
+        just the regex"""
+        if self._find_windows is not None:
+            return self._find_windows(self._regex)
+        # pywinctl needs a display on Linux, so replays can run headless
+        from pywinctl import getWindowsWithTitle, Re
+
+        return getWindowsWithTitle(self._regex, condition=Re.MATCH)
+
+    def _tracked_window_title(self) -> str | None:
+        try:
+            if not self._window.isAlive:
+                return None
+            title = self._window.title
+        except Exception:
+            return None
+        if not self._pattern.search(title):
+            return None
+        return title
+
 
-    return rect, focused, title
+_window_trackers: dict[str, WindowTracker] = {}
+
+
+def get_window_info(regex: str):
+    tracker = _window_trackers.get(regex)
+    if tracker is None:
+        tracker = _window_trackers[regex] = WindowTracker(regex)
+    return tracker.get_info()
@@ -1,21 +1,64 @@
 from __future__ import annotations
 import copy
+import hashlib
 import mss
 import cv2 as cv
 import numpy as np
 import os
+import queue
 import shutil
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from math import ceil
-from time import perf_counter
+from time import perf_counter, sleep
 
-from pp_script.core import _logger, Rect, read_file_at_folder_or_zip
+from pp_script.core import _logger, Rect, PluginArchive, get_time
 
 _logger = _logger.getChild("cv")
 
+_executor: ThreadPoolExecutor = None  # type: ignore
+_executor_lock = threading.Lock()
+_EXECUTOR_THREAD_PREFIX = "pp_script_cv"
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all plugins, OpenCV releases the GIL so its
+    operations can run in parallel"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count(),
+                thread_name_prefix=_EXECUTOR_THREAD_PREFIX,
+            )
+    return _executor
+
 
 class ComputerVision:
-    def __init__(self, cv_values: dict, load_path: str, debug_path: str):
-        self._load_path = load_path
+    PYRAMID_CANDIDATES = 3
+    # Max template positions * template values matched as a stack
+    STACKED_SIZE = 2**20
+    MAX_RESULTS = 1024
+    MAX_TRACKED = 256
+    # Template blocks per side of each prefilter refinement
+    PREFILTER_GRIDS = (2, 4)
+    # Max share of template positions refined block by block
+    PREFILTER_SURVIVORS = 0.01
+
+    def __init__(
+        self,
+        cv_values: dict,
+        archive: PluginArchive,
+        debug_path: str,
+        cache_path: str = None,  # type: ignore
+    ):
+        self._archive = archive
+        self._screen_grabber = self._grabber = ScreenGrabber()
+        self._grab_plans: dict[tuple[str], list] = {}
         self._capture: Capture = None  # type: ignore
         self._rect: Rect = None  # type: ignore
         self._enabled = False
@@ -28,6 +71,38 @@ class ComputerVision:
         self._debug_folder = debug_path
 
         cv_values = copy.deepcopy(cv_values)
+        self._debug_writer = DebugImageWriter(
+            folder=debug_path,
+            max_queue=cv_values.get("debug_queue_size", 32),
+            min_interval=cv_values.get("debug_min_interval", 0.0),
+            png_compression=cv_values.get("debug_png_compression", None),
+            raw=cv_values.get("debug_raw_images", False),
+        )
+        # Pixels worth grabbing to save a separate grab when capturing regions
+        self._grab_overhead = cv_values.get("grab_overhead", 100_000)
+        self._crop_cache_bytes = cv_values.get("crop_cache_mb", 64) * 1024 * 1024
+        self._parallel = cv_values.get("parallel", False)
+        # Results by key, with the fingerprint of the region they came from
+        self._reuse_results = cv_values.get("reuse_results", True)
+        # Opt-in, failed results of rejected templates report the upper bound of
+        # their confidence and its location instead of the best match
+        self._prefilter_enabled = cv_values.get("prefilter", False)
+        # Tracked match locations by (template, region, CVFilter or None, div),
+        # with the shape of the region crop they were found in, most recent last
+        self._tracked: OrderedDict[tuple, tuple[tuple, tuple[int, int]]] = OrderedDict()
+        self._tracked_lock = threading.Lock()
+        self._tracked_rect: Rect = None  # type: ignore
+        # Margin around the last location searched first, in template sizes
+        self._track_margin = cv_values.get("track_margin", 1.0)
+        self._results: OrderedDict[tuple, tuple[int, object]] = OrderedDict()
+        self._results_lock = threading.Lock()
+        self.result_cache_hits = 0
+        self.result_cache_misses = 0
+        self._background: BackgroundGrabber = None  # type: ignore
+        self._background_fps: float = None  # type: ignore
+        if cv_values.get("background_capture", False):
+            self._background_fps = cv_values.get("background_capture_fps", 60)
+            self._background = BackgroundGrabber(max_fps=self._background_fps)
         _scaling_method = cv_values.get("scaling_method", (1920, 1080))
         if isinstance(_scaling_method, tuple):
             ref_rw, ref_rh = _scaling_method
@@ -55,17 +130,41 @@ class ComputerVision:
             values.setdefault("scaling_method", _scaling_method)
             self._regions[name] = Region(values)
 
-        self._templates: dict[str, Template] = {}
+        decoded_cache = None
+        if cv_values.get("template_disk_cache", True):
+            if cache_path is None:
+                cache_path = os.path.join(tempfile.gettempdir(), "pp_script")
+            decoded_cache = DecodedTemplateCache(os.path.join(cache_path, "templates"))
+
+        # Templates are decoded in parallel, OpenCV releases the GIL
+        template_futures = {}
+        max_template_scales = cv_values.get("template_cache_size", 4)
         templates: dict = cv_values.get("templates", {})
         for name, values in templates.items():
             if not isinstance(values, dict):
                 raise ValueError()
             values.setdefault("scaling_method", _scaling_method)
-            self._templates[name] = Template(values, folder_path=load_path)
+            template_futures[name] = get_executor().submit(
+                Template,
+                values,
+                archive=archive,
+                max_scales=max_template_scales,
+                decoded_cache=decoded_cache,
+            )
+        self._templates: dict[str, Template] = {
+            name: future.result() for name, future in template_futures.items()
+        }
+
+        # Scale the templates for common resolutions ahead of time
+        for width, height in cv_values.get("precompute_resolutions", ()):
+            for template in self._templates.values():
+                template.scale(Rect((0, 0, width, height)))
 
     def update(self, rect: Rect, enable: bool):
         self._capture = None  # type: ignore
         self._enabled = enable
+        if self._background:
+            self._background.set_enabled(enable)
         self._try_update_rect(rect=rect)
 
     def _try_update_rect(self, rect: Rect):
@@ -74,19 +173,58 @@ class ComputerVision:
             self._scale_regions_and_templates(rect=rect)
 
     def _scale_regions_and_templates(self, rect: Rect):
+        self._grab_plans = {}
+        with self._results_lock:
+            self._results.clear()
+        # File captures rescale every time, tracked locations only change with
+        # the scale
+        if rect != self._tracked_rect:
+            self._tracked_rect = rect
+            with self._tracked_lock:
+                self._tracked.clear()
         for region_name, region in self._regions.items():
             region.scale(rect)
         for template in self._templates.values():
             template.scale(rect)
 
-    def _regions_bbox(self, region_names: set[str]):
-        regions = [self._regions[k] for k in region_names]
-        region_rects = [region.rect for region in regions]
-        left = min([r.left for r in region_rects])
-        top = min([r.top for r in region_rects])
-        right = max([r.right for r in region_rects])
-        bottom = max([r.bottom for r in region_rects])
-        return left, top, right, bottom
+    def _plan_grabs(self, region_names: tuple[str]):
+        """Groups the regions into grabs, starting with one grab per region and
+        merging the pair whose bbox adds the fewest extra pixels, while those
+        cost less than the overhead of a separate grab"""
+        plan = self._grab_plans.get(region_names)
+        if plan is not None:
+            return plan
+
+        def area(bbox):
+            return (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
+
+        def union(a, b):
+            return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+        # Inclusive (left, top, right, bottom) bboxes
+        plan = []
+        for name in region_names:
+            rect = self._regions[name].rect
+            plan.append((rect.left, rect.top, rect.right, rect.bottom))
+
+        while len(plan) > 1:
+            best = None
+            for i in range(len(plan)):
+                for j in range(i + 1, len(plan)):
+                    merged = union(plan[i], plan[j])
+                    extra = area(merged) - area(plan[i]) - area(plan[j])
+                    if extra < self._grab_overhead and (
+                        best is None or extra < best[0]
+                    ):
+                        best = (extra, i, j, merged)
+            if best is None:
+                break
+            _, i, j, merged = best
+            plan[i] = merged
+            del plan[j]
+
+        self._grab_plans[region_names] = plan
+        return plan
 
     def capture(
         self,
@@ -94,29 +232,48 @@ class ComputerVision:
         file: str = None,
         debug=False,
     ):
-        regions = sorted(regions)
+        regions = tuple(sorted(regions))
 
         capture_rect = self._rect
-        offsets = (0, 0)
 
         img = None
         if file is not None:
-            path = os.path.join(self._load_path, file)
-            img = cv.imread(filename=path)[:, :, ::-1]
+            img_array = np.frombuffer(self._archive.view(file), dtype=np.uint8)
+            img = cv.imdecode(img_array, cv.IMREAD_COLOR_RGB)
             width = img.shape[1]
             height = img.shape[0]
             capture_rect = Rect((0, 0, width, height))
             self._scale_regions_and_templates(rect=capture_rect)
 
+        grab_rects = [capture_rect]
+        offsets = [(0, 0)]
         if regions:
-            regions_bbox = self._regions_bbox(regions)
-            offsets = regions_bbox[:2]
+            plan = self._plan_grabs(regions)
+            grab_rects = []
+            offsets = []
+            for left, top, right, bottom in plan:
+                offsets.append((left, top))
+                grab_rects.append(
+                    Rect(
+                        (
+                            left + capture_rect.left,
+                            top + capture_rect.top,
+                            right - left,
+                            bottom - top,
+                        )
+                    )
+                )
+            # Validate the bbox of all grabs, like a single grab would
+            left = min(bbox[0] for bbox in plan)
+            top = min(bbox[1] for bbox in plan)
+            right = max(bbox[2] for bbox in plan)
+            bottom = max(bbox[3] for bbox in plan)
             capture_rect = Rect(
                 (
-                    regions_bbox[0] + capture_rect.left,
-                    regions_bbox[1] + capture_rect.top,
-                    regions_bbox[2] - regions_bbox[0],
-                    regions_bbox[3] - regions_bbox[1],
+                    left + capture_rect.left,
+                    top + capture_rect.top,
+                    right - left,
+                    bottom - top,
                 )
             )
 
@@ -124,24 +281,77 @@ class ComputerVision:
             # Invalid capture rect, don't try capture
             return False
 
-        if self._enabled or img is not None:
-            self._capture = Capture(rect=capture_rect, offsets=offsets, img=img)
+        capture = None
+        if self._background and img is None and self._enabled:
+            bboxes = tuple(Capture.grab_bbox(rect) for rect in grab_rects)
+            frame = self._background.latest(bboxes)
+            if frame is not None:
+                time, images = frame
+                capture = Capture(
+                    rects=grab_rects,
+                    offsets=offsets,
+                    cache_bytes=self._crop_cache_bytes,
+                    images=images,
+                    time=time,
+                )
+
+        if capture is None and (self._enabled or img is not None):
+            capture = Capture(
+                rects=grab_rects,
+                offsets=offsets,
+                img=img,
+                grabber=self._grabber,
+                cache_bytes=self._crop_cache_bytes,
+            )
+
+        if capture is not None:
+            self._capture = capture
             if debug:
                 regions_text = "_".join(regions)
-                img = self._capture._captured_image.copy()
-                for region in self._regions.values():
-                    left, top, right, bottom = region.rect.as_bbox()
-                    left += -self._capture._offsets[0]
-                    top += -self._capture._offsets[1]
-                    right += -self._capture._offsets[0] - 1
-                    bottom += -self._capture._offsets[1] - 1
-                    cv.rectangle(img, (left, top), (right, bottom), (0, 255, 0), 1)
-
                 second = int(perf_counter())
-                self._save_image(img, f"capture{second}  {regions_text}")
+                grabs = zip(self._capture._offsets, self._capture._captured_images)
+                for i, (offset, img) in enumerate(grabs):
+                    rectangles = []
+                    for region in self._regions.values():
+                        left, top, right, bottom = region.rect.as_bbox()
+                        left += -offset[0]
+                        top += -offset[1]
+                        right += -offset[0] - 1
+                        bottom += -offset[1] - 1
+                        rectangles.append((left, top, right, bottom))
+
+                    name = f"capture{second}  {regions_text}"
+                    if len(offsets) > 1:
+                        name += f" {i}"
+                    # The second changes the name, so captures are rate
+                    # limited by the rest of it
+                    rate_key = f"capture {regions_text} {i}"
+                    self._save_image(img, name, rectangles, rate_key)
 
         return self._capture is not None
 
+    def get_capture_time(self) -> float:
+        """Time the current capture was grabbed at, see get_time"""
+        self._assert_capture()
+        return self._capture.time
+
+    def set_grabber(self, grabber: ScreenGrabber):
+        """Replaces the screen grabber, for example to record or replay the
+        captured frames. Background capture is stopped since it grabs the
+        screen directly, and resumed when the screen grabber is set back"""
+        if self._background:
+            self._background.stop()
+            self._background = None  # type: ignore
+        self._grabber = grabber
+        if grabber is self._screen_grabber and self._background_fps is not None:
+            self._background = BackgroundGrabber(max_fps=self._background_fps)
+            self._background.set_enabled(self._enabled)
+
+    def terminate(self):
+        if self._background:
+            self._background.stop()
+        self._debug_writer.stop()
+
     def _assert_capture(self):
         if self._capture is None:
             msg = f"Failed to assert capture. Make sure to call {self.capture.__name__} and check if it returned True before calling other CV methods"
@@ -163,6 +373,17 @@ class ComputerVision:
                 f"Failed to get region {region_name}, out of capture bounds. {e}"
             ) from e
 
+        left, right, top, bottom = self._div_bounds(img, div)
+        img = img[top:bottom, left:right]
+
+        if debug:
+            filter_name = filter.__name__ if filter else ""
+            name = f"{region_name} region {filter_name} {(left, right, top, bottom)}"
+            self._save_image(img, name)
+        return img
+
+    @staticmethod
+    def _div_bounds(img, div):
         height, width = img.shape[:2]
         left = int(width * div[0])
         right = ceil(width * div[1])
@@ -170,15 +391,8 @@ class ComputerVision:
         bottom = ceil(height * div[3])
 
         if 0 <= left <= right <= width and 0 <= top <= bottom <= height:
-            img = img[top:bottom, left:right].copy()
-        else:
-            raise ValueError(f"Invalid div {div} -> {(left, right, top, bottom)}")
-
-        if debug:
-            filter_name = filter.__name__ if filter else ""
-            name = f"{region_name} region {filter_name} {(left, right, top, bottom)}"
-            self._save_image(img, name)
-        return img
+            return left, right, top, bottom
+        raise ValueError(f"Invalid div {div} -> {(left, right, top, bottom)}")
 
     def match_template(
         self,
@@ -187,15 +401,171 @@ class ComputerVision:
         filter=None,
         div=(0, 1, 0, 1),
         debug=False,
+        pyramid_levels=None,
+        track=False,
     ):
+        """With track, the window around the last successful match is searched
+        first, and the whole region only if that fails"""
         self._assert_capture()
+        # Scripts often pass a new function as the filter every update, so
+        # only CVFilter chains tell tracked locations apart
+        track_filter = filter if isinstance(filter, CVFilter) else None
+        track_key = (template_name, region_name, track_filter, tuple(div))
+
+        def match_template():
+            region_img = self._try_get_region_crop(
+                region_name=region_name, filter=filter, div=div, debug=debug
+            )
+            template_obj = self._get_template(template_name, filter, region_img, debug)
+            if track and (result := self._match_tracked(track_key, region_img, filter)):
+                return result
+
+            if rejected := self._prefilter(region_img, template_obj, filter):
+                result = self._match_result(
+                    template_name, region_name, region_img, *rejected, True
+                )
+            else:
+                min_val, min_loc = self._match(
+                    region_img, template_obj, filter, pyramid_levels
+                )
+                result = self._match_result(
+                    template_name, region_name, region_img, min_val, min_loc
+                )
+            if track:
+                self._track(track_key, region_img, result)
+            return result
 
-        region_img = self._try_get_region_crop(
-            region_name=region_name, filter=filter, div=div, debug=debug
+        key = (template_name, filter, tuple(div), pyramid_levels, track)
+        result = self._reuse_result(region_name, key, debug, match_template)
+        return dict(result)
+
+    def _match_tracked(self, track_key, region_img, filter):
+        """Result of matching the window around the tracked location, None if
+        there isn't one or the template isn't found there"""
+        template_name, region_name, _, _ = track_key
+        with self._tracked_lock:
+            tracked = self._tracked.get(track_key)
+        if tracked is None or tracked[0] != region_img.shape:
+            return None
+
+        x, y = tracked[1]
+        template_obj = self._templates[template_name]
+        template_img, _ = template_obj.scaled_and_filtered(filter)
+        template_h, template_w = template_img.shape[:2]
+        margin_x = ceil(template_w * self._track_margin)
+        margin_y = ceil(template_h * self._track_margin)
+        left = max(0, x - margin_x)
+        top = max(0, y - margin_y)
+        right = min(region_img.shape[1], x + template_w + margin_x)
+        bottom = min(region_img.shape[0], y + template_h + margin_y)
+        window = region_img[top:bottom, left:right]
+
+        min_val, (min_x, min_y) = self._match(window, template_obj, filter, 0)
+        result = self._match_result(
+            template_name, region_name, region_img, min_val, (left + min_x, top + min_y)
         )
+        if not result["success"]:
+            return None
+        result["tracked"] = True
+        self._track(track_key, region_img, result)
+        return result
+
+    def _track(self, track_key, region_img, result):
+        with self._tracked_lock:
+            if not result["success"]:
+                self._tracked.pop(track_key, None)
+                return
+            height, width = region_img.shape[:2]
+            x = round(result["h_pos_percentage"] * width)
+            y = round(result["v_pos_percentage"] * height)
+            self._tracked[track_key] = (region_img.shape, (x, y))
+            self._tracked.move_to_end(track_key)
+            if len(self._tracked) > self.MAX_TRACKED:
+                self._tracked.popitem(last=False)
+
+    def match_templates(
+        self,
+        template_names,
+        region_name,
+        filter=None,
+        div=(0, 1, 0, 1),
+        best_only=False,
+        debug=False,
+        pyramid_levels=None,
+    ):
+        """Matches many templates against the same region crop, returning the
+        results in the same order or only the one with the highest confidence"""
+        self._assert_capture()
+
+        def match_templates():
+            region_img = self._try_get_region_crop(
+                region_name=region_name, filter=filter, div=div, debug=debug
+            )
 
+            # Templates of the same size can be matched together
+            groups: dict[tuple, list[str]] = {}
+            rejected = {}
+            for template_name in template_names:
+                template_obj = self._get_template(
+                    template_name, filter, region_img, debug
+                )
+                if bound := self._prefilter(region_img, template_obj, filter):
+                    rejected[template_name] = bound
+                    continue
+                template_img, _ = template_obj.scaled_and_filtered(filter)
+                groups.setdefault(template_img.shape, []).append(template_name)
+
+            matches = {name: bound + (True,) for name, bound in rejected.items()}
+            for shape, names in groups.items():
+                positions = (region_img.shape[0] - shape[0] + 1) * (
+                    region_img.shape[1] - shape[1] + 1
+                )
+                if len(names) > 1 and positions * np.prod(shape) <= self.STACKED_SIZE:
+                    templates = [self._templates[name] for name in names]
+                    stacked = self._match_stacked(region_img, templates, filter)
+                    matches.update(zip(names, stacked))
+                else:
+                    for name in names:
+                        template_obj = self._templates[name]
+                        matches[name] = self._match(
+                            region_img, template_obj, filter, pyramid_levels
+                        )
+
+            return [
+                self._match_result(name, region_name, region_img, *matches[name])
+                for name in template_names
+            ]
+
+        key = (tuple(template_names), filter, tuple(div), pyramid_levels)
+        results = self._reuse_result(region_name, key, debug, match_templates)
+        results = [dict(result) for result in results]
+        if best_only:
+            return self._best_match(results, region_name, filter, div, pyramid_levels)
+        return results
+
+    def _best_match(self, results, region_name, filter, div, pyramid_levels):
+        """Result with the highest confidence. Confidences of prefiltered results
+        are upper bounds, so those are matched when they come out on top"""
+        while results:
+            best = max(range(len(results)), key=lambda i: results[i]["confidence"])
+            result = results[best]
+            if not result["prefiltered"]:
+                return result
+            region_img = self._try_get_region_crop(
+                region_name=region_name, filter=filter, div=div, debug=False
+            )
+            template_obj = self._templates[result["template"]]
+            min_val, min_loc = self._match(
+                region_img, template_obj, filter, pyramid_levels
+            )
+            results[best] = self._match_result(
+                result["template"], region_name, region_img, min_val, min_loc
+            )
+        return None
+
+    def _get_template(self, template_name, filter, region_img, debug):
         template_obj = self._templates[template_name]
-        template_img, template_mask = template_obj.scaled_and_filtered(filter)
+        template_img, _ = template_obj.scaled_and_filtered(filter)
         if debug:
             filter_name = filter.__name__ if filter else ""
             self._save_image(template_img, f"{template_name} template {filter_name}")
@@ -209,11 +579,125 @@ class ComputerVision:
             raise Exception(
                 f"Template doesn't fit the region {template_img.shape[:2][::-1]} -> {region_img.shape[:2][::-1]}"
             )
+        return template_obj
+
+    def _match(self, region_img, template_obj: Template, filter, pyramid_levels):
+        if pyramid_levels is None:
+            pyramid_levels = template_obj.pyramid_levels
+        if pyramid_levels > 0:
+            min_val, min_loc = self._match_pyramid(
+                region_img, template_obj, filter, pyramid_levels
+            )
+            if min_loc is not None:
+                return min_val, min_loc
+
+        template_img, template_mask = template_obj.scaled_and_filtered(filter)
+        reduction = template_obj.reduction(filter)
+        if reduction is not None and region_img.ndim == 3:
+            match_results = self._match_reduced(region_img, template_mask, reduction)
+        else:
+            match_results = cv.matchTemplate(
+                region_img, template_img, cv.TM_SQDIFF, mask=template_mask
+            )
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(match_results)
+        return min_val, min_loc
+
+    def _match_reduced(self, region_img, template_mask, reduction):
+        """TM_SQDIFF of a template whose channels are all equal or all constant
+        but one, matching a single channel. The squared differences of the other
+        channels don't depend on the template, so they are added as the sum of
+        their per pixel values under the mask"""
+        channel, template_channel, constants = reduction
+        region = region_img.astype(np.float32)
+        channels = region.shape[2]
+        if channel is None:
+            # sum_c (r_c - t)^2 = channels * (mean(r) - t)^2 + sum_c (r_c - mean(r))^2
+            reduced = cv.transform(region, np.full((1, channels), 1 / channels))
+            rest = cv.transform(cv.multiply(region, region), np.ones((1, channels)))
+            rest -= channels * cv.multiply(reduced, reduced)
+            scale = channels
+        else:
+            reduced = np.ascontiguousarray(region[:, :, channel])
+            differences = cv.subtract(region, constants)
+            weights = np.ones((1, channels))
+            weights[0, channel] = 0
+            rest = cv.transform(cv.multiply(differences, differences), weights)
+            scale = 1
 
+        template_h, template_w = template_channel.shape
+        height = region.shape[0] - template_h + 1
+        width = region.shape[1] - template_w + 1
         match_results = cv.matchTemplate(
-            region_img, template_img, cv.TM_SQDIFF, mask=template_mask
+            reduced, template_channel, cv.TM_SQDIFF, mask=template_mask
         )
-        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(match_results)
+        if cv.countNonZero(template_mask) == template_mask.size:
+            rest = cv.boxFilter(
+                rest,
+                -1,
+                (template_w, template_h),
+                anchor=(0, 0),
+                normalize=False,
+                borderType=cv.BORDER_CONSTANT,
+            )
+        else:
+            kernel = (template_mask != 0).astype(np.float32)
+            rest = cv.filter2D(
+                rest, -1, kernel, anchor=(0, 0), borderType=cv.BORDER_CONSTANT
+            )
+        match_results *= scale
+        match_results += rest[:height, :width]
+        return match_results
+
+    def _match_stacked(self, region_img, templates: list[Template], filter):
+        """Masked TM_SQDIFF of same size templates as two matrix products over
+        every template position, for small regions where the per call overhead
+        of matchTemplate dominates"""
+        images, masks = [], []
+        for template_obj in templates:
+            template_img, template_mask = template_obj.scaled_and_filtered(filter)
+            mask = template_mask != 0
+            if template_img.ndim == 3:
+                mask = np.repeat(mask[:, :, None], template_img.shape[2], axis=2)
+            images.append(template_img)
+            masks.append(mask)
+
+        shape = images[0].shape
+        windows = np.lib.stride_tricks.sliding_window_view(
+            region_img, shape[:2], axis=(0, 1)
+        )
+        if region_img.ndim == 3:
+            # (y, x, channel, h, w) -> (y, x, h, w, channel)
+            windows = windows.transpose(0, 1, 3, 4, 2)
+        result_shape = windows.shape[:2]
+        windows = windows.reshape(result_shape[0] * result_shape[1], -1)
+        windows = windows.astype(np.float32)
+
+        masks = np.stack(masks).reshape(len(templates), -1).astype(np.float32)
+        images = np.stack(images).reshape(len(templates), -1).astype(np.float32)
+        images *= masks
+
+        # sum(M * (I - T)^2) = sum(M * I^2) - 2 * sum(M * T * I) + sum(M * T^2)
+        results = (windows * windows) @ masks.T
+        results -= 2 * (windows @ images.T)
+        results += (images * images).sum(axis=1)
+        np.maximum(results, 0, out=results)
+
+        matches = []
+        for min_index in np.argmin(results, axis=0):
+            y, x = divmod(int(min_index), result_shape[1])
+            matches.append((float(results[min_index, len(matches)]), (x, y)))
+        return matches
+
+    def _match_result(
+        self,
+        template_name,
+        region_name,
+        region_img,
+        min_val,
+        min_loc,
+        prefiltered=False,
+    ):
+        template_obj = self._templates[template_name]
         confidence = 1 - min_val / template_obj.size
         result = {
             "success": confidence >= template_obj.threshold,
@@ -222,9 +706,139 @@ class ComputerVision:
             "confidence": confidence,
             "h_pos_percentage": min_loc[0] / region_img.shape[1],
             "v_pos_percentage": min_loc[1] / region_img.shape[0],
+            # The template wasn't matched, the confidence is an upper bound
+            "prefiltered": prefiltered,
+            # Found around the last location, see match_template
+            "tracked": False,
         }
         return result
 
+    def _prefilter(self, region_img, template_obj: Template, filter):
+        """Proves a template can't reach its threshold without matching it. The
+        squared differences of n pixels are at least the squared difference of
+        their sums over n, so the sums of the whole template and then of its
+        blocks give lower bounds of TM_SQDIFF. Returns the lowest bound and its
+        location when every position is above the threshold, None otherwise"""
+        if not self._prefilter_enabled:
+            return None
+        blocks = template_obj.block_sums(filter, 1)
+        if not blocks:
+            # Masked templates, only the sums of the whole template are cheap
+            return None
+
+        template_h, template_w = template_obj.scaled_and_filtered(filter)[0].shape[:2]
+        height = region_img.shape[0] - template_h + 1
+        width = region_img.shape[1] - template_w + 1
+        n = template_h * template_w
+        budget = (1 - template_obj.threshold) * template_obj.size
+        # Margin for the float32 rounding of the means
+        limit = budget / n * (1 + 1e-4) + 1e-3
+        template_means = blocks[0][4] / n
+        if np.sum(np.maximum(template_means, 255 - template_means) ** 2) <= limit:
+            # No region mean can be far enough from the template mean
+            return None
+
+        means = cv.boxFilter(
+            region_img,
+            cv.CV_32F,
+            (template_w, template_h),
+            anchor=(0, 0),
+            borderType=cv.BORDER_CONSTANT,
+        )[:height, :width]
+        differences = cv.subtract(means, tuple(template_means))
+        bounds = cv.multiply(differences, differences)
+        if bounds.ndim == 3:
+            bounds = cv.transform(bounds, np.ones((1, bounds.shape[2])))
+        min_val, _, min_loc, _ = cv.minMaxLoc(bounds)
+        if min_val > limit:
+            return min_val * n, min_loc
+
+        survivors = cv.compare(bounds, limit, cv.CMP_LE)
+        if cv.countNonZero(survivors) > self.PREFILTER_SURVIVORS * height * width:
+            return None
+        ys, xs = np.nonzero(survivors.reshape(height, width))
+        integral = cv.integral(region_img, sdepth=cv.CV_64F)
+        if integral.ndim == 2:
+            integral = integral[:, :, None]
+        for grid in self.PREFILTER_GRIDS:
+            bounds = np.zeros(len(ys))
+            for top, bottom, left, right, sums in template_obj.block_sums(filter, grid):
+                block = (
+                    integral[ys + bottom, xs + right] - integral[ys + top, xs + right]
+                )
+                block -= integral[ys + bottom, xs + left]
+                block += integral[ys + top, xs + left]
+                block -= sums
+                bounds += (block * block).sum(axis=1) / (
+                    (bottom - top) * (right - left)
+                )
+            survivors = bounds <= budget
+            if not survivors.any():
+                i = np.argmin(bounds)
+                return float(bounds[i]), (int(xs[i]), int(ys[i]))
+            ys, xs = ys[survivors], xs[survivors]
+        return None
+
+    def _match_pyramid(self, region_img, template_obj: Template, filter, levels):
+        """Matches downscaled images first, then matches at full resolution only
+        around the best candidates. Returns (None, None) when the images are
+        too small to downscale"""
+        downscaled = template_obj.downscaled(filter, levels)
+        factor = 2**levels
+        height, width = region_img.shape[:2]
+        small_size = (width // factor, height // factor)
+        if downscaled is None or min(small_size) < 1:
+            return None, None
+        small_template, small_mask = downscaled
+        if (
+            small_template.shape[0] > small_size[1]
+            or small_template.shape[1] > small_size[0]
+        ):
+            return None, None
+
+        small_region = cv.resize(region_img, small_size, interpolation=cv.INTER_AREA)
+        match_results = cv.matchTemplate(
+            small_region, small_template, cv.TM_SQDIFF, mask=small_mask
+        )
+
+        template_img, template_mask = template_obj.scaled_and_filtered(filter)
+        template_h, template_w = template_img.shape[:2]
+        best_val, best_loc = None, None
+        for _ in range(self.PYRAMID_CANDIDATES):
+            small_val, _, (x, y), _ = cv.minMaxLoc(match_results)
+            if small_val == np.inf:
+                break
+            # Suppress the neighbours of this candidate, the refinement window
+            # already covers them
+            match_results[max(0, y - 1) : y + 2, max(0, x - 1) : x + 2] = np.inf
+
+            left = max(0, (x - 1) * factor)
+            top = max(0, (y - 1) * factor)
+            right = min(width - template_w, (x + 1) * factor)
+            bottom = min(height - template_h, (y + 1) * factor)
+            if right < left or bottom < top:
+                continue
+            window = region_img[top : bottom + template_h, left : right + template_w]
+            window_results = cv.matchTemplate(
+                window, template_img, cv.TM_SQDIFF, mask=template_mask
+            )
+            min_val, _, min_loc, _ = cv.minMaxLoc(window_results)
+            if best_val is None or min_val < best_val:
+                best_val = min_val
+                best_loc = (left + min_loc[0], top + min_loc[1])
+
+        return best_val, best_loc
+
+    def run_parallel(self, functions: list) -> list:
+        """Calls the functions on the shared thread pool if the parallel mode is
+        enabled, returning their results in the same order"""
+        in_pool = threading.current_thread().name.startswith(_EXECUTOR_THREAD_PREFIX)
+        if not self._parallel or in_pool or len(functions) < 2:
+            return [function() for function in functions]
+
+        futures = [get_executor().submit(function) for function in functions]
+        return [future.result() for future in futures]
+
     def get_region_fill_ratio(
         self,
         region_name,
@@ -233,59 +847,421 @@ class ComputerVision:
         debug=False,
     ):
         self._assert_capture()
+
+        def get_region_fill_ratio():
+            region_crop = self._try_get_region_crop(
+                region_name=region_name, filter=filter, div=div, debug=debug
+            )
+            if len(region_crop.shape) != 2:
+                pass  # log warning
+            return np.count_nonzero(region_crop) / region_crop.size
+
+        key = (filter, tuple(div))
+        return self._reuse_result(region_name, key, debug, get_region_fill_ratio)
+
+    def get_region_fill_ratios(
+        self,
+        region_name,
+        filter,
+        divs,
+        debug=False,
+    ):
+        """Same as get_region_fill_ratio for each div, filtering the region once
+        and counting each div in O(1) with a summed-area table"""
+        self._assert_capture()
+
+        def get_region_fill_ratios():
+            table, channels = self._region_fill_table(region_name, filter, debug)
+            ratios = []
+            for div in divs:
+                left, right, top, bottom = self._div_bounds(table[1:, 1:], div)
+                count = table[bottom, right] - table[top, right]
+                count += table[top, left] - table[bottom, left]
+                ratios.append(int(count) / ((right - left) * (bottom - top) * channels))
+            return ratios
+
+        key = (filter, tuple(tuple(div) for div in divs))
+        ratios = self._reuse_result(region_name, key, debug, get_region_fill_ratios)
+        return list(ratios)
+
+    def get_region_fill_boundary(
+        self,
+        region_name,
+        filter,
+        direction="left_to_right",
+        debug=False,
+    ):
+        """Position from 0 to 1 where a continuous bar filling in the direction
+        ends, the boundary that best splits the region into filled and empty
+        rows or columns"""
+        self._assert_capture()
+
+        def get_region_fill_boundary():
+            table, channels = self._region_fill_table(region_name, filter, debug)
+            height, width = table.shape[0] - 1, table.shape[1] - 1
+            if direction in ("left_to_right", "right_to_left"):
+                totals = table[height, :] / (height * channels)
+            elif direction in ("top_to_bottom", "bottom_to_top"):
+                totals = table[:, width] / (width * channels)
+            else:
+                raise ValueError(f"Invalid direction {direction}")
+            if direction in ("right_to_left", "bottom_to_top"):
+                totals = totals[-1] - totals[::-1]
+
+            # Fill of the first x rows or columns, the best boundary maximizes
+            # the filled ones before it plus the empty ones after it
+            positions = np.arange(totals.shape[0])
+            boundary = int(np.argmax(2 * totals - positions))
+            return boundary / (totals.shape[0] - 1)
+
+        key = (filter, direction)
+        return self._reuse_result(region_name, key, debug, get_region_fill_boundary)
+
+    def _region_fill_table(self, region_name, filter, debug):
+        """Summed-area table of the non zero values in the filtered region, and
+        the number of channels they were summed over"""
         region_crop = self._try_get_region_crop(
-            region_name=region_name, filter=filter, div=div, debug=debug
+            region_name=region_name, filter=filter, div=(0, 1, 0, 1), debug=debug
         )
-        if len(region_crop.shape) != 2:
-            pass  # log warning
-        return np.count_nonzero(region_crop) / region_crop.size
-
-    def _save_image(self, image, name):
-        os.makedirs(self._debug_folder, exist_ok=True)
-        path = os.path.join(self._debug_folder, f"{name}.png")
-        if len(image.shape) == 2:
-            cv.imwrite(path, image)
+        filled = region_crop != 0
+        channels = 1
+        if filled.ndim == 3:
+            channels = filled.shape[2]
+            filled = filled.sum(axis=2, dtype=np.uint8)
+        return cv.integral(filled.view(np.uint8)), channels
+
+    def _reuse_result(self, region_name, key, debug, compute):
+        """Returns the result computed for the key the last time the region had
+        the same pixels, computing it otherwise"""
+        if not self._reuse_results or debug:
+            return compute()
+
+        key = (region_name, compute.__name__) + key
+        try:
+            fingerprint = self._capture.fingerprint(self._regions[region_name])
+        except Capture.RegionOutOfBounds:
+            return compute()
+
+        with self._results_lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._results.move_to_end(key)
+                self.result_cache_hits += 1
+                return entry[1]
+            self.result_cache_misses += 1
+
+        result = compute()
+        with self._results_lock:
+            self._results[key] = (fingerprint, result)
+            if len(self._results) > self.MAX_RESULTS:
+                self._results.popitem(last=False)
+        return result
+
+    def get_result_cache_stats(self) -> dict:
+        return {"hits": self.result_cache_hits, "misses": self.result_cache_misses}
+
+    def _save_image(self, image, name, rectangles=(), rate_key=None):
+        self._debug_writer.save(image, name, rectangles, rate_key)
+
+
+class DebugImageWriter:
+    """Writes debug images on a background thread so encoding doesn't slow down
+    the update. Images are dropped while the queue is full or when the same name
+    was saved less than min_interval seconds ago"""
+
+    # Names whose last save time is kept for the rate limit
+    MAX_NAMES = 256
+
+    def __init__(
+        self,
+        folder: str,
+        max_queue: int = 32,
+        min_interval: float = 0.0,
+        png_compression: int = None,  # type: ignore
+        raw: bool = False,
+    ):
+        self._folder = folder
+        self._min_interval = min_interval
+        self._params = []
+        if png_compression is not None:
+            self._params = [cv.IMWRITE_PNG_COMPRESSION, png_compression]
+        self._raw = raw
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._last_saved: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None  # type: ignore
+        self.dropped = 0
+
+    def save(self, image: np.ndarray, name: str, rectangles=(), rate_key=None):
+        """Queues a copy of the RGB or gray image, the rectangles given as
+        (left, top, right, bottom) are drawn on the copy before writing. Images
+        are rate limited by rate_key, which defaults to the name"""
+        now = get_time()
+        rate_key = name if rate_key is None else rate_key
+        with self._lock:
+            last = self._last_saved.get(rate_key)
+            if last is not None and now - last < self._min_interval:
+                return
+            if self._queue.full():
+                if not self.dropped:
+                    _logger.warning("Debug image queue is full, dropping images")
+                self.dropped += 1
+                return
+            if self._min_interval > 0:
+                self._last_saved[rate_key] = now
+                self._last_saved.move_to_end(rate_key)
+                if len(self._last_saved) > self.MAX_NAMES:
+                    self._last_saved.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            # The images are views into reused buffers, so copy them now
+            self._queue.put_nowait((image.copy(), name, rectangles))
+
+    def stop(self):
+        """Writes the queued images and stops the thread"""
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self._queue.put(None)
+        thread.join()
+
+    def _run(self):
+        os.makedirs(self._folder, exist_ok=True)
+        while (item := self._queue.get()) is not None:
+            image, name, rectangles = item
+            try:
+                self._write(image, name, rectangles)
+            except Exception as e:
+                _logger.warning(f"Failed to write debug image {name}: {e}")
+
+    def _write(self, image, name, rectangles):
+        for left, top, right, bottom in rectangles:
+            cv.rectangle(image, (left, top), (right, bottom), (0, 255, 0), 1)
+        path = os.path.join(self._folder, name)
+        if self._raw:
+            np.save(f"{path}.npy", image)
+        elif len(image.shape) == 2:
+            cv.imwrite(f"{path}.png", image, self._params)
         else:
-            cv.imwrite(path, image[:, :, ::-1])
+            cv.imwrite(f"{path}.png", image[:, :, ::-1], self._params)
+
+
+class ScreenGrabber:
+    """Grabs the screen through a long lived mss instance per thread, frames
+    are converted to RGB into reused buffers"""
+
+    def __init__(self, max_buffers: int = 8):
+        self._max_buffers = max_buffers
+        self._local = threading.local()
+
+    def grab(self, bbox: tuple[int, int, int, int], slot: int = 0) -> np.ndarray:
+        """RGB image of the bbox, overwritten by later grabs of the same size
+        and slot on the same thread"""
+        local = self._local
+        if not hasattr(local, "sct"):
+            local.sct = mss.mss()
+            local.buffers = {}
+
+        shot = local.sct.grab(bbox)
+        shape = (shot.height, shot.width)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shape + (4,))
+
+        buffers: dict[tuple, np.ndarray] = local.buffers
+        key = (slot, shape)
+        buffer = buffers.pop(key, None)
+        if buffer is None:
+            buffer = np.empty(shape + (3,), dtype=np.uint8)
+            if len(buffers) >= self._max_buffers:
+                del buffers[next(iter(buffers))]
+        buffers[key] = buffer  # Most recently used last
+
+        return cv.cvtColor(bgra, cv.COLOR_BGRA2RGB, dst=buffer)
+
+
+class BackgroundGrabber:
+    """Grabs the requested bboxes continuously on a background thread into
+    three sets of buffers, one being written, one holding the latest frame and
+    one in use by the last capture"""
+
+    BUFFERS = 3
+
+    def __init__(self, max_fps: float):
+        self._interval = 1 / max_fps
+        self._condition = threading.Condition()
+        self._bboxes: tuple[tuple[int, int, int, int], ...] = ()
+        self._enabled = False
+        self._running = True
+        # (bboxes, time, images) of each buffer set
+        self._frames: list[tuple | None] = [None] * self.BUFFERS
+        self._latest: int = None  # type: ignore
+        self._in_use: int = None  # type: ignore
+        self._thread: threading.Thread = None  # type: ignore
+
+    def set_enabled(self, enabled: bool):
+        with self._condition:
+            if not enabled:
+                # Frames grabbed before pausing would be stale when resuming
+                self._latest = None
+            self._enabled = enabled
+            self._condition.notify()
+
+    def latest(self, bboxes: tuple[tuple[int, int, int, int], ...]):
+        """Latest (time, images) grabbed for the bboxes, None if there isn't one
+        yet. The images stay valid until the next call"""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            if bboxes != self._bboxes:
+                self._bboxes = bboxes
+                self._condition.notify()
+
+            if self._latest is None:
+                return None
+            frame_bboxes, time, images = self._frames[self._latest]
+            if frame_bboxes != bboxes:
+                return None
+            self._in_use = self._latest
+            return time, images
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def _run(self):
+        grabber = ScreenGrabber(max_buffers=64)
+        failed = False
+        while True:
+            with self._condition:
+                while self._running and not (self._enabled and self._bboxes):
+                    self._condition.wait()
+                if not self._running:
+                    return
+                bboxes = self._bboxes
+                busy = (self._latest, self._in_use)
+                buffer = next(i for i in range(self.BUFFERS) if i not in busy)
+
+            start = get_time()
+            try:
+                images = [
+                    grabber.grab(bbox, slot=buffer * len(bboxes) + i)
+                    for i, bbox in enumerate(bboxes)
+                ]
+                failed = False
+            except Exception as e:
+                if not failed:
+                    _logger.warning(f"Background capture failed: {e}")
+                failed = True
+            else:
+                with self._condition:
+                    self._frames[buffer] = (bboxes, start, images)
+                    self._latest = buffer
+
+            sleep(max(0.0, self._interval - (get_time() - start)))
 
 
 class Capture:
-    def __init__(self, rect: Rect = None, offsets=(0, 0), img=None):
-        self._crops = {}
+    def __init__(
+        self,
+        rects: list[Rect],
+        offsets: list[tuple[int, int]],
+        img=None,
+        grabber: ScreenGrabber = None,
+        cache_bytes: int = 64 * 1024 * 1024,
+        images: list[np.ndarray] = None,
+        time: float = None,
+    ):
+        self._crops: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._crops_bytes = 0
+        self._cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._fingerprints: dict[Region, int] = {}
         self._offsets = offsets
+        self.time = get_time() if time is None else time
+        if images is not None:
+            self._captured_images = images
+            return
+
+        self._captured_images: list[np.ndarray] = []
+        for slot, rect in enumerate(rects):
+            left, top, right, bottom = Capture.grab_bbox(rect)
+            if img is None:
+                image = grabber.grab((left, top, right, bottom), slot=slot)
+            else:
+                image = img[top:bottom, left:right]
+            self._captured_images.append(image)
+
+    @staticmethod
+    def grab_bbox(rect: Rect) -> tuple[int, int, int, int]:
         left, top, right, bottom = rect.as_bbox()
-        right += 1
-        bottom += 1
+        return left, top, right + 1, bottom + 1
 
-        if img is None:
-            with mss.mss() as sct:
-                bgr = np.array(sct.grab((left, top, right, bottom)))[:, :, :3]
-                self._captured_image = bgr[:, :, ::-1]  # BGR to RGB
+    def get_region_crop(self, region: Region, filter=None) -> np.ndarray:
+        """Read only crop of the region, filtered crops are cached until they
+        take more than cache_bytes"""
+        crop = self._crop(region)
+        crop.flags.writeable = False
+        if not filter:
+            return crop
+
+        key = (region, filter)
+        with self._lock:
+            if key in self._crops:
+                self._crops.move_to_end(key)
+                return self._crops[key]
+
+        # Filter outside the lock, other threads might filter the same crop
+        if isinstance(filter, CVFilter) and len(filter) > 1:
+            # Start from the cached result of the previous steps, so for
+            # example one HSV crop is shared by several in_range filters
+            crop = self.get_region_crop(region, filter.parent)
+            crop = filter._apply_last(crop)
         else:
-            self._captured_image = img[top:bottom, left:right]
+            crop = apply_filter(filter, crop)
+        crop.flags.writeable = False
+        with self._lock:
+            if key not in self._crops:
+                self._crops_bytes += crop.nbytes
+            else:
+                self._crops_bytes += crop.nbytes - self._crops[key].nbytes
+            self._crops[key] = crop
+            while self._crops_bytes > self._cache_bytes and len(self._crops) > 1:
+                _, evicted = self._crops.popitem(last=False)
+                self._crops_bytes -= evicted.nbytes
+        return crop
 
-    def get_region_crop(self, region: Region, filter=None) -> np.ndarray:
-        crop_dict = self._crops.setdefault(region, {})
-        if filter not in crop_dict:
+    def fingerprint(self, region: Region) -> int:
+        """Checksum of the region pixels"""
+        with self._lock:
+            fingerprint = self._fingerprints.get(region)
+        if fingerprint is None:
+            crop = np.ascontiguousarray(self._crop(region))
+            fingerprint = zlib.crc32(crop)
+            with self._lock:
+                self._fingerprints[region] = fingerprint
+        return fingerprint
+
+    def _crop(self, region: Region) -> np.ndarray:
+        # Regions are served by the first grab that contains them
+        grabs = zip(self._offsets, self._captured_images)
+        for (offset_x, offset_y), image in grabs:
             left, top, right, bottom = region.rect.as_bbox()
-            left -= self._offsets[0]
-            right -= self._offsets[0]
-            top -= self._offsets[1]
-            bottom -= self._offsets[1]
-            height, width = self._captured_image.shape[:2]
-
-            if left < 0 or top < 0 or right > width or bottom > height:
-                msg = f"Region={region.rect.as_tuple()}"
-                msg += f", Capture={self._offsets+(width, height)}"
-                raise Capture.RegionOutOfBounds(msg)
-
-            crop = self._captured_image[top:bottom, left:right].copy()
-            if filter:
-                crop = filter(crop)
-            crop_dict[filter] = crop
-
-        crop = crop_dict[filter]
-        return crop
+            left -= offset_x
+            right -= offset_x
+            top -= offset_y
+            bottom -= offset_y
+            height, width = image.shape[:2]
+            if 0 <= left and 0 <= top and right <= width and bottom <= height:
+                return image[top:bottom, left:right]
+
+        msg = f"Region={region.rect.as_tuple()}"
+        grabs = zip(self._offsets, self._captured_images)
+        sizes = [offset + image.shape[1::-1] for offset, image in grabs]
+        msg += f", Capture={", ".join(str(s) for s in sizes)}"
+        raise Capture.RegionOutOfBounds(msg)
 
     class RegionOutOfBounds(RuntimeError):
         pass
@@ -311,22 +1287,51 @@ class Region:
 
 
 class Template:
-    def __init__(self, values: dict, folder_path: str):
+    def __init__(
+        self,
+        values: dict,
+        archive: PluginArchive,
+        max_scales: int = 4,
+        decoded_cache: DecodedTemplateCache = None,  # type: ignore
+    ):
         self.threshold = values["threshold"]
+        self.pyramid_levels = values.get("pyramid_levels", 0)
+        # "auto" matches single channel templates on one channel, "rgb" never
+        self.channels = values.get("channels", "auto")
+        if self.channels not in ("auto", "rgb"):
+            raise ValueError(f"Invalid template channels {self.channels}")
         self._scaling_method = values["scaling_method"]
         self._base_image = None
 
-        f = read_file_at_folder_or_zip(folder_path, values["file"])
-        img_array = np.frombuffer(f, dtype=np.uint8)
-        self._base_image = cv.imdecode(img_array, cv.IMREAD_COLOR_RGB)
-        if mask_color := values.get("mask_color", None):
-            mask = cv.inRange(self._base_image, mask_color, mask_color)
-            self._base_mask = cv.bitwise_not(mask)
-        else:
-            self._base_mask = cv.inRange(self._base_image, (0, 0, 0), (255, 255, 255))
+        f = archive.view(values["file"])
+        mask_color = values.get("mask_color", None)
+        key = None
+        if decoded_cache is not None:
+            key = decoded_cache.key(archive.path, values["file"], mask_color, f)
+            if decoded := decoded_cache.load(key):
+                self._base_image, self._base_mask = decoded
 
-        self._scaled_mask = None
-        self._scaled_and_filtered = {}
+        if self._base_image is None:
+            img_array = np.frombuffer(f, dtype=np.uint8)
+            self._base_image = cv.imdecode(img_array, cv.IMREAD_COLOR_RGB)
+            if mask_color:
+                mask = cv.inRange(self._base_image, mask_color, mask_color)
+                self._base_mask = cv.bitwise_not(mask)
+            else:
+                self._base_mask = cv.inRange(
+                    self._base_image, (0, 0, 0), (255, 255, 255)
+                )
+            if decoded_cache is not None:
+                decoded_cache.store(key, self._base_image, self._base_mask)
+
+        # Scaled templates by scaled size, least recently used first
+        self._scales: OrderedDict[tuple[int, int], ScaledTemplate] = OrderedDict()
+        self._max_scales = max_scales
+        self._scaled: ScaledTemplate = None  # type: ignore
+
+    @property
+    def size(self):
+        return self._scaled.size
 
     def scale(self, rect: Rect):
         rx, ry, rw, rh = rect.as_tuple()
@@ -336,6 +1341,12 @@ class Template:
         scaled_w = max(1, int(scaled_w))
         scaled_h = max(1, int(scaled_h))
 
+        key = (scaled_w, scaled_h)
+        if key in self._scales:
+            self._scales.move_to_end(key)
+            self._scaled = self._scales[key]
+            return
+
         template = self._base_image
         mask = self._base_mask
         if scaled_w != w or scaled_h != h:
@@ -350,27 +1361,233 @@ class Template:
                 interpolation=cv.INTER_NEAREST_EXACT,
             )
 
-        self.size = cv.countNonZero(mask) * template.shape[2] * 255 * 255
-        self._scaled_and_filtered = {None: template}
-        self._scaled_mask = mask
+        self._scaled = ScaledTemplate(template, mask)
+        self._scales[key] = self._scaled
+        while len(self._scales) > self._max_scales:
+            self._scales.popitem(last=False)
 
     def scaled_and_filtered(self, filter: callable = None):
-        if filter not in self._scaled_and_filtered:
-            not_filtered = self._scaled_and_filtered[None]
-            self._scaled_and_filtered[filter] = filter(not_filtered)
-        return self._scaled_and_filtered[filter], self._scaled_mask
+        return self._scaled.filtered(filter), self._scaled.mask
+
+    def downscaled(self, filter: callable, levels: int):
+        """Scaled and filtered image and mask downscaled by 2**levels, None if
+        they would be smaller than 2 pixels"""
+        return self._scaled.downscaled(filter, levels)
+
+    def block_sums(self, filter: callable, grid: int):
+        """(top, bottom, left, right, channel sums) of the unmasked blocks of
+        the scaled and filtered image split in grid x grid blocks"""
+        return self._scaled.block_sums(filter, grid)
+
+    def reduction(self, filter: callable):
+        """(channel, template channel, constants) when the scaled and filtered
+        image can be matched on a single channel, see ScaledTemplate"""
+        if self.channels == "rgb":
+            return None
+        return self._scaled.reduction(filter)
+
+
+class DecodedTemplateCache:
+    """Decoded template images and masks saved as .npy files, which later runs
+    map into memory instead of decoding the template files again"""
+
+    VERSION = 1
+
+    def __init__(self, folder: str):
+        self._folder = folder
+
+    @classmethod
+    def key(cls, plugin_path: str, file: str, mask_color, data) -> str:
+        digest = hashlib.sha1(
+            repr((cls.VERSION, plugin_path, file, mask_color)).encode()
+        )
+        digest.update(data)
+        return digest.hexdigest()
+
+    def load(self, key: str) -> tuple[np.ndarray, np.ndarray] | None:
+        try:
+            image = np.load(self._path(key, "image"), mmap_mode="r")
+            mask = np.load(self._path(key, "mask"), mmap_mode="r")
+        except (OSError, ValueError, EOFError):
+            return None
+        return image, mask
+
+    def store(self, key: str, image: np.ndarray, mask: np.ndarray):
+        try:
+            os.makedirs(self._folder, exist_ok=True)
+            # Written under a temporary name and renamed, so other processes
+            # loading the same key never see a partial file. The mask goes last
+            # since it's the second one loaded
+            for kind, array in (("image", image), ("mask", mask)):
+                path = self._path(key, kind)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as file:
+                    np.save(file, array)
+                os.replace(temp_path, path)
+        except OSError as e:
+            _logger.warning(f"Failed to cache decoded template: {e}")
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self._folder, f"{key}.{kind}.npy")
+
+
+class ScaledTemplate:
+    """Template image and mask at one scaled size, with LRU caches of their
+    filtered and downscaled variants"""
+
+    MAX_VARIANTS = 32
+
+    def __init__(self, image: np.ndarray, mask: np.ndarray):
+        self.size = cv.countNonZero(mask) * image.shape[2] * 255 * 255
+        image = image.view()
+        image.flags.writeable = False
+        self.image = image
+        self.mask = mask
+        self._filtered: OrderedDict[callable, np.ndarray] = OrderedDict()
+        self._downscaled: OrderedDict[tuple, tuple | None] = OrderedDict()
+        self._block_sums: OrderedDict[tuple, list] = OrderedDict()
+        self._reductions: OrderedDict[callable, tuple | None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filtered(self, filter: callable = None) -> np.ndarray:
+        if filter is None:
+            return self.image
+        with self._lock:
+            if filter in self._filtered:
+                self._filtered.move_to_end(filter)
+                return self._filtered[filter]
+
+        if isinstance(filter, CVFilter) and len(filter) > 1:
+            filtered = filter._apply_last(self.filtered(filter.parent))
+        else:
+            filtered = apply_filter(filter, self.image)
+        filtered.flags.writeable = False
+        self._add(self._filtered, filter, filtered)
+        return filtered
+
+    def downscaled(self, filter: callable, levels: int):
+        key = (filter, levels)
+        with self._lock:
+            if key in self._downscaled:
+                self._downscaled.move_to_end(key)
+                return self._downscaled[key]
+
+        template = self.filtered(filter)
+        factor = 2**levels
+        size = (template.shape[1] // factor, template.shape[0] // factor)
+        downscaled = None
+        if min(size) >= 2:
+            template = cv.resize(template, size, interpolation=cv.INTER_AREA)
+            mask = cv.resize(self.mask, size, interpolation=cv.INTER_NEAREST)
+            downscaled = (template, mask)
+        self._add(self._downscaled, key, downscaled)
+        return downscaled
+
+    def block_sums(self, filter: callable, grid: int) -> list:
+        key = (filter, grid)
+        with self._lock:
+            if key in self._block_sums:
+                self._block_sums.move_to_end(key)
+                return self._block_sums[key]
+
+        template = self.filtered(filter)
+        height, width = template.shape[:2]
+        rows = np.linspace(0, height, min(grid, height) + 1).round().astype(int)
+        columns = np.linspace(0, width, min(grid, width) + 1).round().astype(int)
+        blocks = []
+        for top, bottom in zip(rows[:-1], rows[1:]):
+            for left, right in zip(columns[:-1], columns[1:]):
+                if not self.mask[top:bottom, left:right].all():
+                    continue
+                block = template[top:bottom, left:right]
+                sums = block.reshape((bottom - top) * (right - left), -1)
+                sums = sums.sum(axis=0, dtype=np.float64)
+                blocks.append((int(top), int(bottom), int(left), int(right), sums))
+        self._add(self._block_sums, key, blocks)
+        return blocks
+
+    def reduction(self, filter: callable) -> tuple | None:
+        """(channel, values of the channel, constants of every channel) when the
+        other channels of the unmasked pixels are constant, (None, values of
+        the first channel, None) when their channels are all equal, otherwise
+        None"""
+        with self._lock:
+            if filter in self._reductions:
+                self._reductions.move_to_end(filter)
+                return self._reductions[filter]
+
+        template = self.filtered(filter)
+        reduction = None
+        pixels = template[self.mask != 0]
+        if template.ndim == 3 and template.shape[2] > 1 and len(pixels):
+            varying = [
+                c
+                for c in range(pixels.shape[1])
+                if pixels[:, c].min() != pixels[:, c].max()
+            ]
+            channels = template.astype(np.float32)
+            if len(varying) <= 1:
+                channel = varying[0] if varying else 0
+                constants = tuple(float(value) for value in pixels[0])
+                values = np.ascontiguousarray(channels[:, :, channel])
+                reduction = (channel, values, constants)
+            elif (pixels == pixels[:, :1]).all():
+                values = np.ascontiguousarray(channels[:, :, 0])
+                reduction = (None, values, None)
+        self._add(self._reductions, filter, reduction)
+        return reduction
+
+    def _add(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.MAX_VARIANTS:
+                cache.popitem(last=False)
+
+
+# Errors of writing to a read only image
+_READ_ONLY_ERRORS = (
+    "assignment destination is read-only",  # numpy item assignment
+    "output array is read-only",  # numpy out= and in place operators
+    "but provided NumPy array marked as readonly",  # OpenCV dst arguments
+)
+
+
+def apply_filter(filter, img: np.ndarray) -> np.ndarray:
+    """Filters get read only images. CVFilter chains and the cv_ functions never
+    write to their input, other filters that fail writing to it are called
+    again with a copy, so whatever they did before the write is done twice"""
+    if isinstance(filter, CVFilter) or filter in (cv_to_hsv, cv_to_gray):
+        return filter(img)
+    try:
+        return filter(img)
+    except (ValueError, cv.error) as e:
+        if not any(message in str(e) for message in _READ_ONLY_ERRORS):
+            raise
+    return filter(img.copy())
 
 
 def cv_in_range(img, lower: tuple, upper: tuple):
-    if lower[0] > upper[0]:
-        # For HSV filters around the red hue (H=0) the H value can wrap around,
-        # for example, if lower=(200, 10, 10) and upper=(30, 50, 50) then we do
-        # range (0, 10, 10)(30, 50, 50) + range (200, 10, 10)(255, 50, 50)
-        first = cv.inRange(img, (0,) + lower[1:], upper)
-        second = cv.inRange(img, lower, (255,) + upper[1:])
-        return cv.bitwise_or(first, second)
-    else:
-        return cv.inRange(img, lower, upper)
+    lower, upper, gap = _compile_in_range(tuple(lower), tuple(upper))
+    mask = cv.inRange(img, lower, upper)
+    if gap is not None:
+        return cv.subtract(mask, cv.inRange(img, *gap), dst=mask)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def _compile_in_range(lower: tuple, upper: tuple):
+    """Bounds are compiled once per range. For HSV filters around the red hue
+    (H=0) the H value can wrap around, for example, if lower=(200, 10, 10) and
+    upper=(30, 50, 50) then we do range (0, 10, 10)(255, 50, 50) minus the hue
+    gap range (31, 0, 0)(199, 255, 255). That is still two passes, but the
+    second one is subtracted in place instead of allocating a third mask"""
+    if lower[0] <= upper[0]:
+        return lower, upper, None
+    rest = len(lower) - 1
+    gap = None
+    if lower[0] - upper[0] > 1:
+        gap = ((upper[0] + 1,) + (0,) * rest, (lower[0] - 1,) + (255,) * rest)
+    return (0,) + lower[1:], (255,) + upper[1:], gap
 
 
 def cv_to_hsv(img):
@@ -379,3 +1596,63 @@ def cv_to_hsv(img):
 
 def cv_to_gray(img):
     return cv.cvtColor(img, cv.COLOR_RGB2GRAY)
+
+
+class CVFilter:
+    """Hashable chain of filter steps. Equal chains share cached results, and
+    chains starting with the same steps share the results of those steps"""
+
+    __slots__ = ("steps",)
+
+    def __init__(self, steps: tuple = ()):
+        self.steps = tuple(steps)
+
+    def to_hsv(self) -> CVFilter:
+        return CVFilter(self.steps + (("to_hsv",),))
+
+    def to_gray(self) -> CVFilter:
+        return CVFilter(self.steps + (("to_gray",),))
+
+    def in_range(self, lower: tuple, upper: tuple) -> CVFilter:
+        return CVFilter(self.steps + (("in_range", tuple(lower), tuple(upper)),))
+
+    @property
+    def parent(self) -> CVFilter:
+        return CVFilter(self.steps[:-1])
+
+    @property
+    def __name__(self):
+        return " ".join(_FILTER_STEP_NAMES[step[0]](*step[1:]) for step in self.steps)
+
+    def _apply_last(self, img):
+        name, *args = self.steps[-1]
+        return _FILTER_STEPS[name](img, *args)
+
+    def __call__(self, img):
+        for name, *args in self.steps:
+            img = _FILTER_STEPS[name](img, *args)
+        return img
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __eq__(self, value):
+        return isinstance(value, CVFilter) and self.steps == value.steps
+
+    def __hash__(self):
+        return hash(self.steps)
+
+    def __repr__(self):
+        return f"CVFilter({self.__name__})"
+
+
+_FILTER_STEPS = {
+    "to_hsv": cv_to_hsv,
+    "to_gray": cv_to_gray,
+    "in_range": cv_in_range,
+}
+_FILTER_STEP_NAMES = {
+    "to_hsv": lambda: "to_hsv",
+    "to_gray": lambda: "to_gray",
+    "in_range": lambda lower, upper: f"in_range{lower}{upper}",
+}
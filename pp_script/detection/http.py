@@ -15,15 +15,22 @@ def ensure_can_bind_to(address: tuple[str, int]):
 
 
 class HTTPHandler:
-    def __init__(self, values: dict, logger: logging.Logger, lib_version: int):
+    def __init__(
+        self,
+        values: dict,
+        logger: logging.Logger,
+        lib_version: int,
+        serve: bool = True,
+    ):
         self._logger = logger.getChild("http")
         self._LIB_VERSION = lib_version
 
         self.thread_lock = threading.Lock()
         self._server: HTTPServer = None  # type: ignore
-        if handle_content := values.get("handle_content"):
+        self._handle_content = values.get("handle_content")
+        if self._handle_content and serve:
             port = int(values["port"])
-            self._launch_server(port, handle_content)
+            self._launch_server(port)
 
         if self._LIB_VERSION <= 2:
             port = int(values["port"])
@@ -59,14 +66,18 @@ class HTTPHandler:
         except Exception as e:
             return {"exception": str(e)}
 
-    def _launch_server(self, port: int, handle_content):
+    def handle_content(self, content):
+        with self.thread_lock:
+            self._handle_content(content)
+
+    def _launch_server(self, port: int):
         address = ("localhost", port)
         try:
             ensure_can_bind_to(address=address)
         except Exception as e:
             raise Exception(f"Failed to bind to address={address}: {e}") from e
 
-        lock = self.thread_lock
+        handler = self
         LIB_VERSION = self._LIB_VERSION
 
         class POSTHandler(BaseHTTPRequestHandler):
@@ -88,8 +99,7 @@ class HTTPHandler:
                 self.end_headers()
                 self.wfile.write(response)
 
-                with lock:
-                    handle_content(content)
+                handler.handle_content(content)
 
             def do_OPTIONS(self):
                 self.send_response(204)
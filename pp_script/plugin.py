@@ -1,18 +1,20 @@
-import typing
-from uuid import uuid4
-
 from pp_script.core import (
     _logger,
     EventType,
     Event,
+    EventBatch,
     Rect,
+    PluginArchive,
     get_window_info,
     get_monitor_rect,
+    close_monitor_layout,
     get_time,
     PPVar,
+    PPVarArray,
 )
 from pp_script.detection.computer_vision import (
     ComputerVision,
+    CVFilter,
     cv_in_range,
     cv_to_hsv,
     cv_to_gray,
@@ -24,7 +26,11 @@ from pp_script.detection.http import HTTPHandler
 class Plugin:
     METADATA: dict = {}
     PATH: str = None  # type: ignore
+    ARCHIVE: PluginArchive = None  # type: ignore
     DEBUG_FOLDER: str = None  # type: ignore
+    CACHE_FOLDER: str = None  # type: ignore
+    # Replays handle recorded HTTP posts without listening to the port
+    SERVE_HTTP: bool = True
 
     @classmethod
     def ID(cls):
@@ -34,6 +40,15 @@ class Plugin:
         full_id += f" by {data.get("author", "AUTHOR")}"
         return full_id
 
+    @classmethod
+    def archive(cls) -> PluginArchive:
+        if cls.ARCHIVE is None or cls.ARCHIVE.path != cls.PATH:
+            # Archives inherited from a parent class are still used by it
+            if cls.ARCHIVE is not None and "ARCHIVE" in cls.__dict__:
+                cls.ARCHIVE.close()
+            cls.ARCHIVE = PluginArchive(cls.PATH)
+        return cls.ARCHIVE
+
     def __init__(self):
         self._event_types: dict[str, EventType] = {}
         super().__init__()
@@ -52,7 +67,7 @@ class Plugin:
         self._pmr: ProcessMemoryReader = None  # type: ignore
         self._http_handler: HTTPHandler = None  # type: ignore
 
-        self.events: dict[typing.Any, Event] = {}
+        self.events: EventBatch = EventBatch()
 
     def get_importable_attributes(self):
         attr = {
@@ -62,13 +77,21 @@ class Plugin:
             "get_time": get_time,
             "plugin_is_focused": self._is_focused,
             "PPVar": PPVar,
+            "PPVarArray": PPVarArray,
             # CV
             "capture": self.capture,
+            "get_capture_time": self.get_capture_time,
             "match_template": self.match_template,
+            "match_templates": self.match_templates,
             "get_region_fill_ratio": self.get_region_fill_ratio,
+            "get_region_fill_ratios": self.get_region_fill_ratios,
+            "get_region_fill_boundary": self.get_region_fill_boundary,
+            "run_parallel": self.run_parallel,
+            "get_result_cache_stats": self.get_result_cache_stats,
             "cv_in_range": cv_in_range,
             "cv_to_hsv": cv_to_hsv,
             "cv_to_gray": cv_to_gray,
+            "CVFilter": CVFilter,
             # Process Memory Reading
             "read_pointer": self.read_pointer,
         }
@@ -90,7 +113,9 @@ class Plugin:
             self._event_types[type_key] = EventType(values)
 
         if cv_values := data.get("cv"):
-            self._cv = ComputerVision(cv_values, self.PATH, self.DEBUG_FOLDER)
+            self._cv = ComputerVision(
+                cv_values, self.archive(), self.DEBUG_FOLDER, self.CACHE_FOLDER
+            )
 
         if pmr_values := data.get("pmr"):
             self._pmr = ProcessMemoryReader(pmr_values, self._logger)
@@ -100,6 +125,7 @@ class Plugin:
                 http_values,
                 self._logger,
                 self._lib_version,
+                serve=self.SERVE_HTTP,
             )
 
         self._update_internals()
@@ -110,7 +136,7 @@ class Plugin:
     def update(self):
         if self._http_handler:
             self._http_handler.thread_lock.acquire()
-        self.events = {}
+        self.events = EventBatch()
         self._update_internals()
 
     def post_update(self):
@@ -154,7 +180,7 @@ class Plugin:
         return rect, focused, message
 
     def _raise_event(self, values: dict):
-        event_id = values.pop("id", uuid4())
+        event_id = values.pop("id", None)
         if event_id in self.events:
             self._logger.warning(
                 f"Raising an event with ID={event_id}, an event with that ID was already raised this update and will be overwritten"
@@ -164,11 +190,14 @@ class Plugin:
         if type_name is not None:
             event_type = self._event_types[type_name]
         event = Event(event_type, values)
-        self.events[event_id] = event
+        self.events.add(event, event_id)
 
     def terminate(self):
         if self._http_handler:
             self._http_handler.terminate()
+        if self._cv:
+            self._cv.terminate()
+        close_monitor_layout()
 
     # CV attributes
     @property
@@ -185,6 +214,9 @@ class Plugin:
     ) -> bool:
         return self.cv.capture(regions=regions, file=file, debug=debug)
 
+    def get_capture_time(self) -> float:
+        return self.cv.get_capture_time()
+
     def match_template(
         self,
         template: str,
@@ -192,6 +224,8 @@ class Plugin:
         filter=None,
         div: tuple = (0, 1, 0, 1),
         debug: bool = False,
+        pyramid_levels: int = None,  # type: ignore
+        track: bool = False,
     ) -> dict:
         return self.cv.match_template(
             template_name=template,
@@ -199,6 +233,26 @@ class Plugin:
             filter=filter,
             div=div,
             debug=debug,
+            pyramid_levels=pyramid_levels,
+            track=track,
+        )
+
+    def match_templates(
+        self,
+        templates: tuple[str],
+        region: str,
+        filter=None,
+        div: tuple = (0, 1, 0, 1),
+        best_only: bool = False,
+        debug: bool = False,
+    ) -> list[dict] | dict:
+        return self.cv.match_templates(
+            template_names=templates,
+            region_name=region,
+            filter=filter,
+            div=div,
+            best_only=best_only,
+            debug=debug,
         )
 
     def get_region_fill_ratio(
@@ -215,6 +269,40 @@ class Plugin:
             debug=debug,
         )
 
+    def get_region_fill_ratios(
+        self,
+        region: str,
+        filter=None,
+        divs: tuple[tuple] = (),  # type: ignore
+        debug: bool = False,
+    ) -> list[float]:
+        return self.cv.get_region_fill_ratios(
+            region_name=region,
+            filter=filter,
+            divs=divs,
+            debug=debug,
+        )
+
+    def get_region_fill_boundary(
+        self,
+        region: str,
+        filter=None,
+        direction: str = "left_to_right",
+        debug: bool = False,
+    ) -> float:
+        return self.cv.get_region_fill_boundary(
+            region_name=region,
+            filter=filter,
+            direction=direction,
+            debug=debug,
+        )
+
+    def run_parallel(self, functions: list) -> list:
+        return self.cv.run_parallel(functions=functions)
+
+    def get_result_cache_stats(self) -> dict:
+        return self.cv.get_result_cache_stats()
+
     # PMR attributes
     @property
     def pmr(self):
@@ -53,7 +53,7 @@ restricted_python_globals["enumerate"] = enumerate
 restricted_python_globals["_inplacevar_"] = _inplacevar_
 
 CURRENT_PP_SCRIPT_VERSION = 3
-from pp_script.core import _logger as parent_logger, read_file_at_folder_or_zip
+from pp_script.core import _logger as parent_logger, PluginArchive
 
 logger = parent_logger.getChild("import")
 from pp_script.plugin import Plugin
@@ -63,7 +63,7 @@ class ImportedPlugin(Plugin):
     def __init__(self):
         super().__init__()
         script_name: str = self.METADATA.get("script")  # type: ignore
-        script = read_file_at_folder_or_zip(self.PATH, script_name)
+        script = self.archive().read(script_name)
         script = script.decode("utf-8")
         # Developers might want import statements for static analysis and
         # autocompletion, but imports can't be compiled/executed, so we
@@ -104,21 +104,33 @@ class ImportedPlugin(Plugin):
 
 def try_import_plugin_at_folder(folder_path: str) -> typing.Type[ImportedPlugin] | None:
     try:
-        file = read_file_at_folder_or_zip(folder_path, "metadata.yaml")
+        archive = PluginArchive(folder_path)
     except FileNotFoundError:
         return None
 
-    metadata: dict = yaml.safe_load(file)
+    # The archive keeps a zip open and mapped, so it's closed unless the
+    # plugin class takes it
+    try:
+        metadata: dict = yaml.safe_load(archive.read("metadata.yaml"))
+    except FileNotFoundError:
+        archive.close()
+        return None
+    except BaseException:
+        archive.close()
+        raise
+
     required_version = metadata.get("req_lib_ver", 0)
     if required_version > CURRENT_PP_SCRIPT_VERSION:
         logger.error(
             f"""Failed to import plugin at {folder_path}, plugin requires library version {required_version}, current version is {CURRENT_PP_SCRIPT_VERSION}. Check for newer app versions"""
         )
+        archive.close()
         return None
 
     class ThisImportedPlugin(ImportedPlugin): ...
 
     ThisImportedPlugin.METADATA = metadata
     ThisImportedPlugin.PATH = folder_path
+    ThisImportedPlugin.ARCHIVE = archive
 
     return ThisImportedPlugin
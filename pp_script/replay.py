@@ -0,0 +1,418 @@
+"""Records the inputs of a plugin session and replays them offline.
+
+A recording is an uncompressed zip with an index.json and the grabbed frames
+as PNG files, repeated frames are stored once. Frames are decoded on demand,
+so replays can start from any update of the recording. Recordings are read
+as zips whatever their file extension.
+
+Usage: python -m pp_script.replay RECORDING [PLUGIN_PATH] [--start N] [--stop N]
+"""
+
+import argparse
+import base64
+import json
+import os
+import tempfile
+import threading
+import zipfile
+import zlib
+import cv2 as cv
+import numpy as np
+from collections import Counter, OrderedDict
+from time import perf_counter
+
+from pp_script.core import _logger, EventID, Rect, get_time, set_clock
+from pp_script.plugin import Plugin
+
+_logger = _logger.getChild("replay")
+
+RECORDING_VERSION = 1
+_INDEX_NAME = "index.json"
+
+
+class SessionRecorder:
+    """Records the updates of a plugin instance until closed, the host keeps
+    calling the plugin as usual. Closing puts back everything the recorder
+    replaced on the plugin"""
+
+    def __init__(self, plugin: Plugin, path: str, png_compression: int = 1):
+        self._plugin = plugin
+        self._path = path
+        self._png_params = [cv.IMWRITE_PNG_COMPRESSION, png_compression]
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self._lock = threading.Lock()
+        self._ticks: list[dict] = []
+        self._tick: dict = None  # type: ignore
+        self._posts: list = []
+        # Frame member names by (bbox, shape, crc32)
+        self._frames: dict[tuple, str] = {}
+        self._update_thread: int = None  # type: ignore
+        self._closed = False
+        # (object, attribute, replaced value) of every patched attribute,
+        # the value is None for attributes the object didn't have itself
+        self._patches: list[tuple[object, str, object]] = []
+        self._grabber = None
+        self._header = {
+            "version": RECORDING_VERSION,
+            "plugin_path": plugin.PATH,
+            "start_time": plugin._last_focus_and_rect_update,
+            "window": _window_to_json(plugin.rect, plugin.focused),
+        }
+        self._attach()
+
+    def _attach(self):
+        plugin = self._plugin
+        update = plugin.update
+        update_focus_and_rect = plugin._update_focus_and_rect
+
+        def recorded_update():
+            if self._closed:
+                return update()
+            with self._lock:
+                posts, self._posts = self._posts, []
+            time = get_time()
+            self._update_thread = threading.get_ident()
+            self._tick = {"time": time, "posts": posts, "calls": [], "clock": []}
+            try:
+                update()
+            finally:
+                self._tick["events"] = _event_summaries(plugin.events)
+                self._ticks.append(self._tick)
+                self._tick = None  # type: ignore
+
+        def recorded_update_focus_and_rect():
+            rect, focused, message = update_focus_and_rect()
+            if self._tick is not None:
+                self._tick["window"] = _window_to_json(rect, focused)
+            return rect, focused, message
+
+        self._patch(plugin, "update", recorded_update)
+        self._patch(plugin, "_update_focus_and_rect", recorded_update_focus_and_rect)
+        set_clock(self._recorded_clock)
+
+        if plugin._cv:
+            self._grabber = plugin._cv._grabber
+            plugin._cv.set_grabber(_RecordingGrabber(self._grabber, self))
+        if pmr := plugin._pmr:
+            read_pointer = self._recorded_call("read_pointer", pmr.read_pointer)
+            self._patch(pmr, "read_pointer", read_pointer)
+        if handler := plugin._http_handler:
+            self._patch(handler, "get", self._recorded_call("http_get", handler.get))
+            get_v2 = self._recorded_call("http_get_v2", handler._get_v2)
+            self._patch(handler, "_get_v2", get_v2)
+            if handler._handle_content:
+                handle_content = handler._handle_content
+
+                def recorded_handle_content(content):
+                    if not self._closed:
+                        with self._lock:
+                            post = [get_time(), _content_to_json(content)]
+                            self._posts.append(post)
+                    handle_content(content)
+
+                self._patch(handler, "_handle_content", recorded_handle_content)
+
+    def _patch(self, obj, name: str, value):
+        self._patches.append((obj, name, obj.__dict__.get(name)))
+        setattr(obj, name, value)
+
+    def _detach(self):
+        for obj, name, replaced in reversed(self._patches):
+            if replaced is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, replaced)
+        self._patches.clear()
+        if self._grabber is not None:
+            self._plugin._cv.set_grabber(self._grabber)
+
+    def _recorded_clock(self) -> float:
+        # Replays return the same times to the same get_time calls of the update
+        time = perf_counter()
+        tick = self._tick
+        if tick is not None and threading.get_ident() == self._update_thread:
+            tick["clock"].append(time)
+        return time
+
+    def _recorded_call(self, name: str, function):
+        def recorded(*args, **kwargs):
+            result = function(*args, **kwargs)
+            if self._tick is not None:
+                self._tick["calls"].append([name, result])
+            return result
+
+        return recorded
+
+    def add_frame(self, bbox: tuple, image: np.ndarray):
+        if self._tick is None or self._closed:
+            return
+        key = (bbox, image.shape, zlib.crc32(np.ascontiguousarray(image)))
+        with self._lock:
+            member = self._frames.get(key)
+            if member is None:
+                member = f"frames/{len(self._frames)}.png"
+                if len(image.shape) == 3:
+                    image = image[:, :, ::-1]
+                _, data = cv.imencode(".png", image, self._png_params)
+                self._zip.writestr(member, data.tobytes())
+                self._frames[key] = member
+        self._tick.setdefault("grabs", []).append([list(bbox), member])
+
+    def close(self):
+        """Writes the index, the recording can't be replayed before closing"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        set_clock()
+        self._detach()
+        with self._lock:
+            index = dict(self._header, ticks=self._ticks)
+            self._zip.writestr(_INDEX_NAME, json.dumps(index))
+            self._zip.close()
+        _logger.info(f"Recorded {len(self._ticks)} updates to {self._path}")
+
+
+class _RecordingGrabber:
+    def __init__(self, grabber, recorder: SessionRecorder):
+        self._grabber = grabber
+        self._recorder = recorder
+
+    def grab(self, bbox: tuple[int, int, int, int], slot: int = 0) -> np.ndarray:
+        image = self._grabber.grab(bbox, slot=slot)
+        self._recorder.add_frame(tuple(bbox), image)
+        return image
+
+
+class Recording:
+    """Index of a recording, with its frames decoded on demand"""
+
+    def __init__(self, path: str, max_decoded: int = 16):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        index: dict = json.loads(self._zip.read(_INDEX_NAME))
+        if index["version"] > RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version {index['version']}")
+        self.plugin_path: str = index["plugin_path"]
+        self.start_time: float = index["start_time"]
+        self.window = index["window"]
+        self.ticks: list[dict] = index["ticks"]
+        self._decoded: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._max_decoded = max_decoded
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def frame(self, member: str) -> np.ndarray:
+        if member in self._decoded:
+            self._decoded.move_to_end(member)
+            return self._decoded[member]
+        data = np.frombuffer(self._zip.read(member), dtype=np.uint8)
+        image = cv.imdecode(data, cv.IMREAD_UNCHANGED)
+        if len(image.shape) == 3:
+            image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+        self._decoded[member] = image
+        while len(self._decoded) > self._max_decoded:
+            self._decoded.popitem(last=False)
+        return image
+
+    def close(self):
+        self._zip.close()
+
+
+class _ReplayGrabber:
+    def __init__(self, recording: Recording):
+        self._recording = recording
+        self.grabs: list = []
+
+    def grab(self, bbox: tuple[int, int, int, int], slot: int = 0) -> np.ndarray:
+        left, top, right, bottom = bbox
+        for (g_left, g_top, g_right, g_bottom), member in self.grabs:
+            if (
+                g_left <= left
+                and g_top <= top
+                and right <= g_right
+                and bottom <= g_bottom
+            ):
+                image = self._recording.frame(member)
+                return image[
+                    top - g_top : bottom - g_top, left - g_left : right - g_left
+                ]
+        raise Exception(f"No recorded frame contains the bbox {bbox}")
+
+
+def replay(
+    plugin_class: type[Plugin],
+    recording: Recording,
+    start: int = 0,
+    stop: int = None,  # type: ignore
+) -> dict:
+    """Runs a new instance of the plugin class through the recorded updates as
+    fast as possible, with get_time returning the recorded times. Returns the
+    events raised, the updates whose events differ from the recorded ones and
+    the throughput"""
+    ticks = recording.ticks[start:stop]
+    grabber = _ReplayGrabber(recording)
+    clock = _ReplayClock(recording.start_time)
+    state = {"window": recording.window, "calls": []}
+
+    class ReplayedPlugin(plugin_class):
+        SERVE_HTTP = False
+        DEBUG_FOLDER = plugin_class.DEBUG_FOLDER or os.path.join(
+            tempfile.gettempdir(), "pp_script", "replay"
+        )
+
+        def _set_plugin_data(self, data: dict):
+            # Pointers are replayed, so the process is never opened
+            data = {key: value for key, value in data.items() if key != "pmr"}
+            super()._set_plugin_data(data)
+            if self._cv:
+                self._cv.set_grabber(grabber)
+
+        def _update_focus_and_rect(self):
+            rect, focused = _window_from_json(state["window"])
+            return rect, focused, f"Replaying {recording.path}\nRect = {rect}"
+
+        def read_pointer(self, pointer_name: str, debug=False):
+            return _replayed_call(state, "read_pointer")
+
+        def http_get(self, url: str, timeout=0.1) -> dict:
+            return _replayed_call(state, "http_get")
+
+        def _http_get_v2(self, path_name: str) -> dict:
+            return _replayed_call(state, "http_get_v2")
+
+    set_clock(clock)
+    try:
+        plugin = ReplayedPlugin()
+        events = []
+        mismatches = []
+        start_seconds = perf_counter()
+        for i, tick in enumerate(ticks, start=start):
+            for time, content in tick["posts"]:
+                clock.set(time)
+                if plugin._http_handler and plugin._http_handler._handle_content:
+                    plugin._http_handler.handle_content(_content_from_json(content))
+
+            clock.set(tick["time"], tick["clock"])
+            state["window"] = tick.get("window", state["window"])
+            state["calls"] = list(tick["calls"])
+            grabber.grabs = tick.get("grabs", [])
+            plugin.update()
+            summaries = _event_summaries(plugin.events)
+            plugin.post_update()
+
+            events.append([tick["time"], summaries])
+            if summaries != tick["events"]:
+                mismatches.append(i)
+        seconds = perf_counter() - start_seconds
+        plugin.terminate()
+    finally:
+        set_clock()
+
+    recorded_seconds = ticks[-1]["time"] - ticks[0]["time"] if ticks else 0.0
+    counts = Counter(summary for _, summaries in events for summary in summaries)
+    return {
+        "updates": len(ticks),
+        "events": events,
+        "event_counts": dict(counts),
+        "mismatched_updates": mismatches,
+        "seconds": seconds,
+        "updates_per_second": len(ticks) / seconds if seconds else 0.0,
+        "speedup": recorded_seconds / seconds if seconds else 0.0,
+    }
+
+
+class _ReplayClock:
+    """Returns the times recorded for the get_time calls of an update in order,
+    then the last one"""
+
+    def __init__(self, time: float):
+        self._time = time
+        self._readings: list[float] = []
+        self._next = 0
+
+    def set(self, time: float, readings: list[float] = []):
+        self._time = time
+        self._readings = readings
+        self._next = 0
+
+    def __call__(self) -> float:
+        if self._next < len(self._readings):
+            self._time = self._readings[self._next]
+            self._next += 1
+        return self._time
+
+
+def _replayed_call(state: dict, name: str):
+    calls: list = state["calls"]
+    for i, (call_name, result) in enumerate(calls):
+        if call_name == name:
+            del calls[i]
+            return result
+    _logger.warning(f"No recorded {name} call left for this update")
+    return None
+
+
+def _event_summaries(events: dict) -> list[str]:
+    summaries = []
+    for event_id, event in events.items():
+        text = f"{event!r} {event.other_data!r}"
+        if not isinstance(event_id, EventID):
+            text = f"{event_id!r}: {text}"
+        summaries.append(text)
+    return summaries
+
+
+def _window_to_json(rect: Rect, focused: bool):
+    return [rect.as_tuple() if rect else None, focused]
+
+
+def _window_from_json(window) -> tuple[Rect, bool]:
+    rect, focused = window
+    return (Rect(tuple(rect)) if rect else None), focused  # type: ignore
+
+
+def _content_to_json(content):
+    if isinstance(content, bytes):
+        return {"bytes": base64.b64encode(content).decode("ascii")}
+    return {"content": content}
+
+
+def _content_from_json(content: dict):
+    if "bytes" in content:
+        return base64.b64decode(content["bytes"])
+    return content["content"]
+
+
+def main():
+    from pp_script.plugin_import import try_import_plugin_at_folder
+
+    parser = argparse.ArgumentParser(description="Replays a plugin recording")
+    parser.add_argument("recording")
+    parser.add_argument("plugin_path", nargs="?", help="defaults to the recorded one")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--stop", type=int, default=None)
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    plugin_path = args.plugin_path or recording.plugin_path
+    plugin_class = try_import_plugin_at_folder(plugin_path)
+    if plugin_class is None:
+        raise SystemExit(f"No plugin found at {plugin_path}")
+    try:
+        report = replay(plugin_class, recording, start=args.start, stop=args.stop)
+    finally:
+        recording.close()
+
+    print(f"{report['updates']} updates in {report['seconds']:.3f}s", end=" ")
+    print(f"({report['updates_per_second']:.1f}/s, {report['speedup']:.1f}x)")
+    for summary, count in report["event_counts"].items():
+        print(f"{count:>8} {summary}")
+    if mismatches := report["mismatched_updates"]:
+        print(f"Events differ from the recording in {len(mismatches)} updates")
+        print(f"First: {mismatches[:10]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from pp_script.core import PluginArchive, Rect
+from pp_script.detection.computer_vision import ComputerVision
+
+
+@pytest.fixture
+def make_cv(tmp_path):
+    """Builds a ComputerVision with a "region" covering the RGB frame and the
+    given {name: (RGB image, template values)}, and captures the frame"""
+
+    def make(frame: np.ndarray, templates: dict, **options) -> ComputerVision:
+        folder = tmp_path / "plugin"
+        folder.mkdir(exist_ok=True)
+        cv.imwrite(str(folder / "frame.png"), frame[:, :, ::-1])
+        template_values = {}
+        for name, (image, values) in templates.items():
+            cv.imwrite(str(folder / f"{name}.png"), image[:, :, ::-1])
+            template_values[name] = {"file": f"{name}.png", "threshold": 0.9} | values
+
+        height, width = frame.shape[:2]
+        cv_values = {
+            "scaling_method": (width, height),
+            "regions": {"region": {"rect": {"x": 0, "y": 0, "w": width, "h": height}}},
+            "templates": template_values,
+            "reuse_results": False,
+            "template_disk_cache": False,
+        } | options
+        cv_obj = ComputerVision(
+            cv_values, PluginArchive(str(folder)), str(tmp_path / "debug")
+        )
+        cv_obj.update(Rect((0, 0, width, height)), True)
+        assert cv_obj.capture(file="frame.png")
+        return cv_obj
+
+    return make
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from pp_script import core
+from pp_script.detection.computer_vision import DebugImageWriter
+
+
+@pytest.fixture
+def clock():
+    now = [0.0]
+    core.set_clock(lambda: now[0])
+    yield now
+    core.set_clock()
+
+
+def test_names_changing_every_second_are_rate_limited_by_key(tmp_path, clock):
+    writer = DebugImageWriter(str(tmp_path), min_interval=5)
+    image = np.zeros((4, 4, 3), np.uint8)
+    for second in range(10):
+        clock[0] = second
+        writer.save(image, f"capture{second} hud", rate_key="capture hud")
+    writer.stop()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "capture0 hud.png",
+        "capture5 hud.png",
+    ]
+
+
+def test_save_times_are_bounded(tmp_path, clock):
+    writer = DebugImageWriter(str(tmp_path), max_queue=1024, min_interval=1)
+    image = np.zeros((2, 2), np.uint8)
+    for i in range(DebugImageWriter.MAX_NAMES * 2):
+        writer.save(image, f"image {i}")
+    writer.stop()
+    assert len(writer._last_saved) == DebugImageWriter.MAX_NAMES
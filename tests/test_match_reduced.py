@@ -0,0 +1,63 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+MAGENTA = (255, 0, 255)
+
+
+def gray_template(rng):
+    return rng.integers(0, 256, (12, 12, 1), np.uint8).repeat(3, axis=2)
+
+
+def one_channel_template(rng):
+    template = np.empty((12, 12, 3), np.uint8)
+    template[:, :] = (40, 0, 200)
+    template[:, :, 1] = rng.integers(0, 256, (12, 12))
+    return template
+
+
+def masked(template):
+    template = template.copy()
+    template[:3, :5] = MAGENTA
+    template[-2:, -2:] = MAGENTA
+    return template
+
+
+@pytest.mark.parametrize(
+    "make_template, mask_color",
+    [
+        (gray_template, None),
+        (one_channel_template, None),
+        (lambda rng: masked(gray_template(rng)), MAGENTA),
+        (lambda rng: masked(one_channel_template(rng)), MAGENTA),
+    ],
+    ids=["gray", "one_channel", "masked_gray", "masked_one_channel"],
+)
+def test_reduced_match_equals_rgb_match(make_cv, rng, make_template, mask_color):
+    frame = cv.GaussianBlur(rng.integers(0, 256, (90, 120, 3), np.uint8), (5, 5), 0)
+    template = make_template(rng)
+    frame[30:42, 70:82] = template
+    values = {"mask_color": mask_color} if mask_color else {}
+    cv_obj = make_cv(frame, {"t": (template, values)})
+
+    template_obj = cv_obj._templates["t"]
+    reduction = template_obj.reduction(None)
+    assert reduction is not None
+    region = cv_obj._try_get_region_crop("region", None, (0, 1, 0, 1), False)
+    template_img, template_mask = template_obj.scaled_and_filtered(None)
+    expected = cv.matchTemplate(region, template_img, cv.TM_SQDIFF, mask=template_mask)
+
+    reduced = cv_obj._match_reduced(region, template_mask, reduction)
+    np.testing.assert_allclose(reduced, expected, rtol=1e-5, atol=expected.max() * 1e-6)
+
+    min_val, min_loc = cv_obj._match(region, template_obj, None, 0)
+    expected_val, _, expected_loc, _ = cv.minMaxLoc(expected)
+    assert min_loc == expected_loc == (70, 30)
+    assert min_val == pytest.approx(expected_val, abs=expected.max() * 1e-6)
+
+
+def test_rgb_channels_option_disables_the_reduction(make_cv, rng):
+    frame = rng.integers(0, 256, (40, 40, 3), np.uint8)
+    template = gray_template(rng)
+    cv_obj = make_cv(frame, {"t": (template, {"channels": "rgb"})})
+    assert cv_obj._templates["t"].reduction(None) is None
@@ -0,0 +1,57 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+MAGENTA = (255, 0, 255)
+
+
+@pytest.mark.parametrize("gray", [False, True], ids=["rgb", "gray"])
+def test_stacked_match_equals_match_template(make_cv, rng, gray):
+    frame = cv.GaussianBlur(rng.integers(0, 256, (40, 60, 3), np.uint8), (3, 3), 0)
+    images = {
+        "crop": frame[5:15, 20:30].copy(),
+        "noise": rng.integers(0, 256, (10, 10, 3), np.uint8),
+        "flat": np.full((10, 10, 3), (200, 40, 40), np.uint8),
+        "masked": frame[22:32, 41:51].copy(),
+    }
+    images["masked"][:3, :3] = MAGENTA
+    values = {"masked": {"mask_color": MAGENTA}}
+    cv_obj = make_cv(
+        frame, {name: (image, values.get(name, {})) for name, image in images.items()}
+    )
+    filter = (lambda img: cv.cvtColor(img, cv.COLOR_RGB2GRAY)) if gray else None
+    region = cv_obj._try_get_region_crop("region", filter, (0, 1, 0, 1), False)
+    templates = [cv_obj._templates[name] for name in images]
+
+    stacked = cv_obj._match_stacked(region, templates, filter)
+    for template_obj, (min_val, (x, y)) in zip(templates, stacked):
+        template_img, template_mask = template_obj.scaled_and_filtered(filter)
+        expected = cv.matchTemplate(
+            region, template_img, cv.TM_SQDIFF, mask=template_mask
+        )
+        expected_val, _, expected_loc, _ = cv.minMaxLoc(expected)
+        # float32 products, near ties may pick another position of equal value
+        tolerance = expected.max() * 1e-5 + 1
+        assert min_val == pytest.approx(expected_val, abs=tolerance)
+        assert expected[y, x] == pytest.approx(expected_val, abs=tolerance)
+
+    assert stacked[0][1] == (20, 5)
+    assert stacked[3][1] == (41, 22)
+
+
+def test_match_templates_uses_the_stacked_match(make_cv, rng, monkeypatch):
+    frame = rng.integers(0, 256, (30, 40, 3), np.uint8)
+    images = {f"t{i}": frame[i : i + 8, 2 * i : 2 * i + 8].copy() for i in range(3)}
+    cv_obj = make_cv(frame, {name: (image, {}) for name, image in images.items()})
+    calls = []
+    match_stacked = cv_obj._match_stacked
+    monkeypatch.setattr(
+        cv_obj, "_match_stacked", lambda *args: calls.append(1) or match_stacked(*args)
+    )
+
+    results = cv_obj.match_templates(list(images), "region")
+    assert calls
+    for i, result in enumerate(results):
+        assert result["success"] and result["confidence"] == pytest.approx(1)
+        assert result["h_pos_percentage"] == pytest.approx(2 * i / 40)
+        assert result["v_pos_percentage"] == pytest.approx(i / 30)
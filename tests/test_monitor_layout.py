@@ -0,0 +1,95 @@
+import pytest
+
+from pp_script.core import MonitorLayout
+
+
+class FakeMSS:
+    """Caches the monitors like mss, UNLOADED is the value before enumerating"""
+
+    UNLOADED: list | None = []
+    layout = [{"left": 0, "top": 0, "width": 1920, "height": 1080}]
+
+    def __init__(self):
+        self._monitors = self.UNLOADED if self.UNLOADED is None else []
+        self.enumerations = 0
+        self.closed = False
+
+    @property
+    def monitors(self):
+        assert not self.closed
+        if self._monitors == self.UNLOADED:
+            self.enumerations += 1
+            self._monitors = [dict(m) for m in FakeMSS.layout]
+        return self._monitors
+
+    def close(self):
+        self.closed = True
+
+
+class NoneMarkerMSS(FakeMSS):
+    UNLOADED = None
+
+
+class LoadedFlagMSS(FakeMSS):
+    """Unknown internals, resetting the cache leaves the monitors empty"""
+
+    def __init__(self):
+        super().__init__()
+        self._loaded = False
+
+    @property
+    def monitors(self):
+        assert not self.closed
+        if not self._loaded:
+            self._loaded = True
+            self.enumerations += 1
+            self._monitors = [dict(m) for m in FakeMSS.layout]
+        return self._monitors
+
+
+@pytest.fixture(autouse=True)
+def layout_reset():
+    default = list(FakeMSS.layout)
+    yield
+    FakeMSS.layout = default
+
+
+@pytest.mark.parametrize("mss_class", [FakeMSS, NoneMarkerMSS, LoadedFlagMSS])
+def test_refresh_follows_layout_changes(mss_class):
+    instances = []
+
+    def open_mss():
+        instances.append(mss_class())
+        return instances[-1]
+
+    layout = MonitorLayout(open_mss)
+    assert layout.refresh()
+    assert not layout.refresh()
+    assert layout.get_rect(0).width == 1920
+
+    FakeMSS.layout = FakeMSS.layout + [
+        {"left": 1920, "top": 0, "width": 1280, "height": 1024}
+    ]
+    assert layout.refresh()
+    rect = layout.get_rect(1)
+    assert (rect.left, rect.width, rect.height) == (1920, 1280, 1024)
+    if mss_class is LoadedFlagMSS:
+        assert all(sct.closed for sct in instances[:-1])
+    else:
+        assert len(instances) == 1
+
+
+def test_close_closes_instances_and_refresh_reopens():
+    instances = []
+
+    def open_mss():
+        instances.append(FakeMSS())
+        return instances[-1]
+
+    layout = MonitorLayout(open_mss)
+    layout.refresh()
+    layout.close()
+    assert instances[0].closed
+
+    assert not layout.refresh()
+    assert len(instances) == 2 and not instances[1].closed
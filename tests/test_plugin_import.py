@@ -0,0 +1,59 @@
+import gc
+import warnings
+import zipfile
+
+from pp_script.plugin_import import try_import_plugin_at_folder
+
+
+def write_zip(path, files: dict):
+    with zipfile.ZipFile(path, "w") as zip:
+        for name, data in files.items():
+            zip.writestr(name, data)
+    return str(path)
+
+
+def import_without_leaks(path):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        plugin_class = try_import_plugin_at_folder(path)
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+    return plugin_class
+
+
+def test_missing_metadata_closes_the_archive(tmp_path):
+    path = write_zip(tmp_path / "plugin.zip", {"script.py": "pass"})
+    assert import_without_leaks(path) is None
+
+
+def test_too_new_plugin_closes_the_archive(tmp_path):
+    metadata = "name: Future\nscript: script.py\nreq_lib_ver: 9999\n"
+    path = write_zip(tmp_path / "plugin.zip", {"metadata.yaml": metadata})
+    assert import_without_leaks(path) is None
+
+
+def test_imported_plugin_keeps_the_archive_open(tmp_path):
+    metadata = "name: Test\nscript: script.py\nreq_lib_ver: 3\n"
+    path = write_zip(tmp_path / "plugin.zip", {"metadata.yaml": metadata})
+    plugin_class = try_import_plugin_at_folder(path)
+    assert plugin_class is not None
+    assert plugin_class.archive().read("metadata.yaml") == metadata.encode()
+    plugin_class.archive().close()
+
+
+def test_changing_the_path_closes_the_previous_archive(tmp_path):
+    metadata = "name: Test\nscript: script.py\nreq_lib_ver: 3\n"
+    first = write_zip(tmp_path / "first.zip", {"metadata.yaml": metadata})
+    second = write_zip(tmp_path / "second.zip", {"metadata.yaml": metadata})
+    plugin_class = try_import_plugin_at_folder(first)
+    assert plugin_class is not None
+    archive = plugin_class.archive()
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        plugin_class.PATH = second
+        assert plugin_class.archive().path == second
+        del archive
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+    plugin_class.archive().close()
@@ -0,0 +1,104 @@
+import random
+from typing import Any
+
+import pytest
+
+from pp_script import core
+from pp_script.core import PPVar
+
+
+class ReferencePPVar:
+    """PPVar as it was before its samples were kept in a ring buffer"""
+
+    def __init__(self, time_window: float = 0, tolerance: float = float("inf")) -> None:
+        self._time_window = time_window
+        self._tolerance = tolerance
+        self._value = None
+        self._buffer = {}
+
+    @property
+    def value(self):
+        return self._value
+
+    def update(self, new_value: float | None) -> Any:
+        if new_value is None:
+            self._buffer = {}
+            self._value = None
+            return None
+
+        time = core.get_time()
+        self._buffer[time] = new_value
+
+        buffered_enough_values = False
+        for k in sorted(list(self._buffer), reverse=True):
+            if buffered_enough_values:
+                del self._buffer[k]
+                continue
+            time_delta = time - k
+            if self._time_window <= time_delta <= 2 * self._time_window:
+                buffered_enough_values = True
+
+        if not buffered_enough_values:
+            return None
+
+        for value in self._buffer.values():
+            if abs(new_value - value) > self._tolerance:
+                return None
+
+        delta = None
+        if self._value is not None:
+            delta = new_value - self._value
+
+        self._value = new_value
+        return delta
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    core.set_clock(clock)
+    yield clock
+    core.set_clock()
+
+
+def run_both(clock, steps, time_window, tolerance):
+    new = PPVar(time_window=time_window, tolerance=tolerance)
+    old = ReferencePPVar(time_window=time_window, tolerance=tolerance)
+    for step, (time, value) in enumerate(steps):
+        clock.now = time
+        assert new.update(value) == old.update(value), step
+        assert new.value == old.value, step
+
+
+def test_matches_reference_without_window(clock):
+    steps = [(0, 1), (0, 2), (1, 2), (2, None), (3, 5), (3, 4)]
+    run_both(clock, steps, time_window=0, tolerance=float("inf"))
+
+
+def test_matches_reference_with_window_and_tolerance(clock):
+    steps = [(0.0, 10), (0.2, 11), (0.5, 11), (0.5, 12), (1.0, 12), (1.6, 20)]
+    steps += [(2.0, 20), (2.0, None), (2.1, 20), (2.7, 21), (3.9, 21)]
+    run_both(clock, steps, time_window=0.5, tolerance=1.5)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_reference_on_random_sequences(clock, seed):
+    rng = random.Random(seed)
+    time_window = rng.choice([0, 0.05, 0.1, 0.5, 1.0])
+    tolerance = rng.choice([float("inf"), 0, 1, 3, 10])
+    steps = []
+    time = 0.0
+    for _ in range(rng.randint(1, 60)):
+        # Repeated timestamps happen when updating faster than the clock ticks
+        time += rng.choice([0, 0, 0.01, 0.03, 0.1, 0.2, 0.7])
+        value = None if rng.random() < 0.05 else rng.randint(0, 12)
+        steps.append((round(time, 2), value))
+    run_both(clock, steps, time_window, tolerance)
@@ -0,0 +1,88 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+THRESHOLDS = (0.8, 0.9, 0.97, 0.99)
+
+
+def hud_frame(rng):
+    frame = cv.GaussianBlur(rng.integers(0, 256, (120, 160, 3), np.uint8), (5, 5), 0)
+    frame[10:40, 10:70] = (200, 40, 40)
+    frame[60:90, 90:150] = (20, 20, 20)
+    frame[95:115, 20:60] = (230, 230, 230)
+    return frame
+
+
+def templates(rng, frame):
+    half = np.full((16, 16, 3), (230, 20, 20), np.uint8)
+    half[8:] = rng.integers(0, 256, (8, 16, 3))
+    return {
+        "red": np.full((16, 16, 3), (200, 40, 40), np.uint8),
+        "dark": np.full((16, 16, 3), (20, 20, 20), np.uint8),
+        "blue": np.full((16, 16, 3), (30, 60, 220), np.uint8),
+        "half": half,
+        "noise": rng.integers(0, 256, (16, 16, 3), np.uint8),
+        "crop": frame[45:61, 100:116].copy(),
+    }
+
+
+def both(make_cv, frame, images, threshold):
+    values = {name: (image, {"threshold": threshold}) for name, image in images.items()}
+    return make_cv(frame, values, prefilter=True), make_cv(frame, values)
+
+
+def assert_equivalent(on: dict, off: dict):
+    assert on["success"] == off["success"]
+    if on["prefiltered"]:
+        # Rejected templates report an upper bound of their confidence
+        assert on["confidence"] >= off["confidence"] - 1e-9
+    else:
+        assert on == off
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_prefilter_never_changes_success(make_cv, rng, threshold):
+    frame = hud_frame(rng)
+    images = templates(rng, frame)
+    on, off = both(make_cv, frame, images, threshold)
+    filters = (None, lambda img: cv.cvtColor(img, cv.COLOR_RGB2GRAY))
+
+    prefiltered = 0
+    for name in images:
+        for filter in filters:
+            result = on.match_template(name, "region", filter=filter)
+            assert_equivalent(result, off.match_template(name, "region", filter=filter))
+            prefiltered += result["prefiltered"]
+    # Low thresholds leave too much budget to reject these templates
+    assert prefiltered or threshold < 0.9
+
+    names = list(images)
+    for on_result, off_result in zip(
+        on.match_templates(names, "region"), off.match_templates(names, "region")
+    ):
+        assert_equivalent(on_result, off_result)
+    for subset in (names, names[:3], names[1:5]):
+        best = on.match_templates(subset, "region", best_only=True)
+        assert best == off.match_templates(subset, "region", best_only=True)
+
+
+def test_best_only_matches_prefiltered_templates_ranked_first(make_cv):
+    def checker(height, width, low, high):
+        cells = np.indices((height, width)).sum(axis=0) % 2
+        return np.where(cells[..., None], high, low).repeat(3, axis=2).astype(np.uint8)
+
+    # The flat template is rejected with a bound above the checker's actual
+    # confidence, while its own confidence is below it
+    frame = checker(60, 80, 90, 166)
+    images = {
+        "flat": np.full((16, 16, 3), 110, np.uint8),
+        "checker": checker(16, 16, 65, 191),
+    }
+    on, off = both(make_cv, frame, images, 0.999)
+    results = on.match_templates(["flat", "checker"], "region")
+    assert results[0]["prefiltered"]
+    assert results[0]["confidence"] > results[1]["confidence"]
+
+    best = on.match_templates(["flat", "checker"], "region", best_only=True)
+    assert best["template"] == "checker"
+    assert best == off.match_templates(["flat", "checker"], "region", best_only=True)
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from pp_script.core import Rect
+from pp_script.detection import computer_vision
+from pp_script.plugin_import import try_import_plugin_at_folder
+from pp_script.replay import Recording, SessionRecorder, replay
+
+SCRIPT = """
+init({"events": {"fill": {}}, "cv": CV_VALUES})
+def update():
+    if capture():
+        raise_event({"type": "fill", "amount": get_region_fill_ratio("bar", filter=FILTER)})
+"""
+CV_VALUES = {
+    "scaling_method": (64, 48),
+    "regions": {"bar": {"rect": {"x": 8, "y": 20, "w": 48, "h": 8}}},
+    "template_disk_cache": False,
+    "background_capture": True,
+}
+FILTER = "CVFilter().to_gray().in_range((128,), (255,))"
+
+
+@pytest.fixture
+def screen(monkeypatch):
+    screen = {"image": np.zeros((48, 64, 3), np.uint8)}
+
+    def grab(self, bbox, slot=0):
+        left, top, right, bottom = bbox
+        return screen["image"][top:bottom, left:right].copy()
+
+    monkeypatch.setattr(computer_vision.ScreenGrabber, "grab", grab)
+    return screen
+
+
+@pytest.fixture
+def plugin_class(tmp_path):
+    folder = tmp_path / "plugin"
+    folder.mkdir()
+    script = SCRIPT.replace("CV_VALUES", repr(CV_VALUES)).replace("FILTER", FILTER)
+    (folder / "script.py").write_text(script)
+    (folder / "metadata.yaml").write_text(
+        "name: Test\nscript: script.py\nreq_lib_ver: 3\n"
+    )
+    imported = try_import_plugin_at_folder(str(folder))
+
+    class TestPlugin(imported):  # type: ignore
+        DEBUG_FOLDER = str(tmp_path / "debug")
+
+        def _update_focus_and_rect(self):
+            return Rect((0, 0, 64, 48)), True, "Test"
+
+    return TestPlugin
+
+
+def fill_bar(screen, i):
+    screen["image"][:] = 0
+    screen["image"][20:28, 8 : 8 + 4 * (i + 1)] = 255
+
+
+def run(plugin, screen, updates):
+    fills = []
+    for i in updates:
+        fill_bar(screen, i)
+        plugin.update()
+        fills.append([event.other_data for event in plugin.events.values()])
+        plugin.post_update()
+    return fills
+
+
+def test_plugin_keeps_working_after_closing_the_recorder(
+    tmp_path, screen, plugin_class
+):
+    plugin = plugin_class()
+    cv_obj = plugin._cv
+    screen_grabber = cv_obj._grabber
+    recorder = SessionRecorder(plugin, str(tmp_path / "session.zip"))
+    assert cv_obj._background is None
+    run(plugin, screen, range(3))
+    recorder.close()
+
+    assert "update" not in plugin.__dict__
+    assert "_update_focus_and_rect" not in plugin.__dict__
+    assert cv_obj._grabber is screen_grabber
+    assert cv_obj._background is not None
+
+    fills = run(plugin, screen, range(3, 6))
+    assert all(fill for fill in fills)
+    assert len(recorder._ticks) == 3
+    plugin.terminate()
+
+
+def test_recordings_replay_whatever_their_extension(tmp_path, screen, plugin_class):
+    plugin = plugin_class()
+    path = str(tmp_path / "session.rec")
+    recorder = SessionRecorder(plugin, path)
+    run(plugin, screen, range(5))
+    recorder.close()
+    plugin.terminate()
+
+    recording = Recording(path)
+    try:
+        report = replay(plugin_class, recording)
+    finally:
+        recording.close()
+    assert report["updates"] == 5
+    assert report["mismatched_updates"] == []
@@ -0,0 +1,76 @@
+import re
+from types import SimpleNamespace
+
+from pp_script.core import Rect, WindowTracker
+
+
+class FakeWindow:
+    def __init__(self, title, left=0, top=0, width=800, height=600):
+        self.title = title
+        self.isAlive = True
+        self.isActive = False
+        self._frame = SimpleNamespace(
+            left=left, top=top, right=left + width, bottom=top + height
+        )
+
+    def getClientFrame(self):
+        return self._frame
+
+
+class FakeDesktop:
+    def __init__(self, *windows):
+        self.windows = list(windows)
+        self.searches = 0
+
+    def find_windows(self, regex):
+        self.searches += 1
+        pattern = re.compile(regex)
+        return [w for w in self.windows if w.isAlive and pattern.search(w.title)]
+
+
+def test_keeps_the_tracked_window():
+    game = FakeWindow("Game", 10, 20, 640, 480)
+    desktop = FakeDesktop(FakeWindow("Editor"), game)
+    tracker = WindowTracker("Game", find_windows=desktop.find_windows)
+
+    rect, focused, title = tracker.get_info()
+    assert (rect.left, rect.top, rect.width, rect.height) == (10, 20, 640, 480)
+    assert (focused, title) == (False, "Game")
+
+    game.isActive = True
+    game.title = "Game - Level 2"
+    rect, focused, title = tracker.get_info()
+    assert (focused, title) == (True, "Game - Level 2")
+    assert desktop.searches == 1
+
+
+def test_searches_again_when_the_title_stops_matching():
+    first = FakeWindow("Game")
+    second = FakeWindow("Game 2", 100, 100)
+    desktop = FakeDesktop(first, second)
+    tracker = WindowTracker("^Game", find_windows=desktop.find_windows)
+    assert tracker.get_info()[2] == "Game"
+
+    first.title = "Loading"
+    rect, _, title = tracker.get_info()
+    assert title == "Game 2"
+    assert (rect.left, rect.top) == (100, 100)
+    assert desktop.searches == 2
+
+
+def test_searches_again_when_the_window_closes():
+    first = FakeWindow("Game")
+    desktop = FakeDesktop(first)
+    tracker = WindowTracker("Game", find_windows=desktop.find_windows)
+    assert tracker.get_info()[2] == "Game"
+
+    first.isAlive = False
+    assert tracker.get_info() == (None, False, None)
+    assert desktop.searches == 2
+
+    reopened = FakeWindow("Game", 5, 5)
+    desktop.windows.append(reopened)
+    rect, _, title = tracker.get_info()
+    assert title == "Game"
+    assert isinstance(rect, Rect) and (rect.left, rect.top) == (5, 5)
+    assert desktop.searches == 3